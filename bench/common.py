@@ -0,0 +1,145 @@
+#shared bits for the benchmarks
+"""
+Helpers used by the scripts in bench/. Run those from the repo root as 
+modules (eg python -m bench.transport) so config, model and skt import.
+
+All benchmarks bind to 127.0.0.x loopback addresses. Linux routes the 
+whole 127/8 block to loopback out of the box; on macOS you'll need to 
+add aliases first (sudo ifconfig lo0 alias 127.0.0.N up).
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import platform
+import threading
+import contextlib
+
+from skt import pigclient
+from skt import pigserver
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile, pct in 0-100. None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    """min/p50/p99/max/mean of a list of seconds, reported in ms"""
+    if not values:
+        return None
+    ms = lambda v: round(v * 1000, 3)
+    return {'count': len(values),
+            'min': ms(min(values)),
+            'p50': ms(percentile(values, 50)),
+            'p99': ms(percentile(values, 99)),
+            'max': ms(max(values)),
+            'mean': ms(sum(values) / len(values)),
+           }
+
+
+def countFds():
+    """Open file descriptors in this process, or None where we can't tell"""
+    for path in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(path))
+        except OSError:
+            continue
+    return None
+
+
+class Sampler:
+    """Background thread that keeps the peak thread and fd count while a run is going"""
+    
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peakThreads = 0
+        self.peakFds = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        
+    def _run(self):
+        while not self._stop.is_set():
+            self.peakThreads = max(self.peakThreads, threading.active_count())
+            fds = countFds()
+            if fds is not None:
+                self.peakFds = max(self.peakFds or 0, fds)
+            self._stop.wait(self.interval)
+            
+    def __enter__(self):
+        self._thread.start()
+        return self
+        
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def loopback(index, base=1):
+    """index-th 127.0.x.y address, skipping .0 and .255"""
+    n = base + index
+    return '127.0.%d.%d' % (n // 254, n % 254 + 1)
+
+
+def startServer(address, inQueue=None):
+    """Run a PigServer on address in a daemon thread. Returns (server, queue)"""
+    server = pigserver.PigServer()
+    server.running = True
+    inQueue = inQueue if inQueue is not None else queue.SimpleQueue()
+    threading.Thread(target=server.listen, args=(address, inQueue), daemon=True).start()
+    waitListening(address)
+    return server, inQueue
+
+
+def waitListening(address, timeout=5):
+    """Block until something accepts connections on address"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(address, timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.01)
+    raise RuntimeError(f"nothing listening on {address}")
+
+
+def stopServer(server, address):
+    """Same trick Model.stopServer uses: clear running, then poke the select loop"""
+    server.running = False
+    pigclient.sendMessage(address, {'text': 'stop'}, timeout=1)
+
+
+def environment():
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           }
+
+
+@contextlib.contextmanager
+def quiet(verbose=True):
+    """Model/PigServer print() a lot. Keep stdout for the report (chatter to stderr, or nowhere)"""
+    if verbose:
+        with contextlib.redirect_stdout(sys.stderr):
+            yield
+    else:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+
+
+def emit(report, path=None):
+    """Write the report as json, to path or stdout"""
+    text = json.dumps(report, indent=2)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
@@ -0,0 +1,183 @@
+#discovery benchmark
+"""
+What one Model.scan() sweep costs on a simulated subnet.
+
+For each peer count we put the node under test at 127.0.S.1 and real
+Model peers at 127.0.S.2 onwards, each with a thread that handles its
+queue as soon as it's woken (so scans get replied to right away). The
+rest of the /24 has nobody listening. On loopback those addresses refuse
+connections instantly, so this is the best case for silent hosts; on a
+real LAN they'd hang until SEND_TIMEOUT.
+
+Every round, the node scans (and with --all-scan, so does every peer,
+which is what a real network does and shows the N x N growth). We wait
+until all send threads are done and all queues are drained, then report:
+
+    scan_call_ms    time inside scan() itself (spawning a thread per host)
+    settle_ms       until all scan/reply traffic is finished
+    messages        scans + replies delivered to any node this round
+    threads_spawned, peak_threads, peak_fds, cpu_seconds
+    sends           pigclient sends this round, from any node
+    discovered      peers that showed up in the node's contacts this round,
+                    and discovery_ms: time from round start until they did
+
+With --discover, scanners call Model.discover() instead of sweeping every
+round: the first round is a full sweep, later ones only scan known peers
+and whoever their replies list (see config.PEER_EXCHANGE). Compare its
+messages/sends against a plain --all-scan run.
+
+    python -m bench.discovery --peers 4 16 64 --rounds 3
+    python -m bench.discovery --peers 100 200 --all-scan --out discovery.json
+    python -m bench.discovery --peers 100 --all-scan --discover --rounds 4
+"""
+
+import sys
+import time
+import argparse
+import threading
+
+import config
+import model
+import metrics
+from bench import common
+
+
+class Node:
+    """A Model plus a thread that runs checkInQueue whenever the model wakes it"""
+
+    def __init__(self, address):
+        self.model = model.Model(address)
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.running = True
+        self.received = 0
+        self.roundStart = time.perf_counter()
+        self.discovered = {}    #fromkey -> seconds after its round started
+        self.model.setWakeup(self.event.set)
+        threading.Thread(target=self.loop, daemon=True).start()
+
+    def loop(self):
+        while self.running:
+            self.event.wait()
+            self.event.clear()
+            with self.lock:
+                self.received += self.model.inQueue.qsize()
+                self.model.checkInQueue()
+                for fromkey in self.model.popChanges()['added']:
+                    self.discovered.setdefault(fromkey, time.perf_counter() - self.roundStart)
+
+    def scan(self, rnge):
+        with self.lock:
+            self.model.scan(rnge)
+
+    def discover(self):
+        with self.lock:
+            self.model.discover()
+
+    def idle(self):
+        return self.model.inQueue.empty() and not self.event.is_set()
+
+    def stop(self):
+        self.running = False
+        self.event.set()
+        common.stopServer(self.model.serverObject, self.model.ADDRESS)
+
+
+def settle(nodes, baseline, timeout):
+    """Wait for scan threads to finish and every queue to drain"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if threading.active_count() <= baseline and all(node.idle() for node in nodes):
+            return True
+        time.sleep(0.002)
+    return False
+
+
+def runSize(subnet, peers, rounds, allScan, port, timeout, discover=False):
+    network = '127.0.%d.' % subnet
+    rnge = (1, 255)
+    node = Node((network + '1', port))
+    others = [Node((network + str(2 + i), port)) for i in range(peers)]
+    everyone = [node] + others
+    for n in everyone:
+        common.waitListening(n.model.ADDRESS)
+    scanners = everyone if allScan else [node]
+    sends = metrics.counter('client.sends')
+
+    results = []
+    for r in range(rounds):
+        for n in everyone:
+            n.received = 0
+        seenBefore = len(node.discovered)
+        sent = sends.read()
+
+        with common.Sampler() as sampler:
+            baseline = threading.active_count()    #includes the sampler
+            cpu = time.process_time()
+            start = time.perf_counter()
+            for n in everyone:
+                n.roundStart = start
+            for n in scanners:
+                if discover:
+                    n.discover()
+                else:
+                    n.scan(rnge)
+            scanCall = time.perf_counter() - start
+            settled = settle(everyone, baseline, timeout)
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+
+        newTimes = list(node.discovered.values())[seenBefore:]
+        results.append({'round': r + 1,
+                        'scan_call_ms': round(scanCall * 1000, 3),
+                        'settle_ms': round(wall * 1000, 3),
+                        'settled': settled,
+                        'messages': sum(n.received for n in everyone),
+                        'sends': sends.read() - sent,
+                        'threads_spawned': None if discover else len(scanners) * (rnge[1] - rnge[0]),
+                        'peak_threads': sampler.peakThreads,
+                        'peak_fds': sampler.peakFds,
+                        'cpu_seconds': round(cpu, 4),
+                        'discovered': len(newTimes),
+                        'known_peers': len(node.model.contacts) - 1,
+                        'discovery_ms': common.summarize(newTimes),
+                       })
+
+    for n in everyone:
+        n.stop()
+    return {'peers': peers, 'silent': 254 - 1 - peers, 'all_scan': allScan, 'discover': discover,
+            'rounds': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Model.scan() discovery benchmark")
+    parser.add_argument('--peers', type=int, nargs='+', default=[4, 16, 64])
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--all-scan', action='store_true', help="every peer scans each round too")
+    parser.add_argument('--discover', action='store_true',
+                        help="use Model.discover() (sweep once, then peer exchange)")
+    parser.add_argument('--port', type=int, default=config.PORT)
+    parser.add_argument('--timeout', type=float, default=60, help="max seconds to wait for a round")
+    parser.add_argument('--verbose', action='store_true', help="show Model's prints on stderr")
+    parser.add_argument('--out', help="write json here instead of stdout")
+    args = parser.parse_args(argv)
+
+    sizes = []
+    with common.quiet(args.verbose):
+        for i, peers in enumerate(args.peers):
+            if not 0 <= peers <= 253:
+                parser.error("peers must fit in one /24 next to the node (0-253)")
+            sizes.append(runSize(100 + i, peers, args.rounds, args.all_scan, args.port, args.timeout,
+                                 args.discover))
+
+    for size in sizes:
+        for r in size['rounds']:
+            print(f"peers={size['peers']:<4} round={r['round']} "
+                  f"settle={r['settle_ms']}ms messages={r['messages']} sends={r['sends']} "
+                  f"peak_threads={r['peak_threads']} discovered={r['discovered']}", file=sys.stderr)
+
+    common.emit({'benchmark': 'discovery', 'env': common.environment(), 'sizes': sizes}, args.out)
+
+
+if __name__ == "__main__":
+    main()
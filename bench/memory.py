@@ -0,0 +1,304 @@
+#memory benchmark
+"""
+Python heap used per unit of the things a node keeps around, measured with
+tracemalloc, plus a leak check.
+
+    contact_bytes           one contact (Model.addContact)
+    message_bytes           one inbound message, decoded from json like
+                            SockData does, through Model.receiveMessage
+                            (message dict, seen id, convo entry)
+    connection_bytes        one open, idle inbound connection (socket + SockData)
+    connection_left_bytes   what's still held per connection after they close
+    scan_peak_bytes         extra heap at the peak of one Model.scan() round
+    scan_left_bytes         what a scan round leaves behind (median), once contacts
+                            are known and the first rounds' one-off growth
+                            (selector and thread tables, interned strings) is
+                            out of the way
+    soak_growth_bytes       growth per round of a scan + chat soak after warmup,
+                            with history/seen-id caps set low so steady state
+                            comes quickly. Should be about 0
+    canvas_row_bytes        (--gui only) Python side of one laid out bubble:
+                            PigCanvas row + layout cache entry. Tk's own
+                            memory isn't visible to tracemalloc.
+
+Compare against a baseline file, and exit 1 if anything got more than
+--tolerance worse:
+
+    python -m bench.memory
+    python -m bench.memory --baseline bench/memory_baseline.json
+    python -m bench.memory --write-baseline bench/memory_baseline.json
+"""
+
+import gc
+import sys
+import json
+import time
+import uuid
+import socket
+import random
+import argparse
+import statistics
+import threading
+import tracemalloc
+
+import config
+import model
+import metrics
+from bench import common
+from bench import discovery
+
+
+#per-unit numbers below this many bytes of difference are noise
+SLACK = 256
+
+#scan rounds not counted in scan_left_bytes. The first adds the contacts,
+#the next few still grow dicts/sets that then stay that size
+SCAN_WARMUP = 4
+
+
+def current():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def inbound(sender, node, text):
+    """A message as SockData would hand it over: freshly decoded json"""
+    wire = json.dumps({'to': node, 'from': sender, 'timestamp': time.time(),
+                       'text': text, 'id': uuid.uuid4().hex, 'nickname': 'mem'})
+    return json.loads(wire)
+
+
+def texts(count, seed=1):
+    """Chat-like message texts, same skew as Model.fillTestData"""
+    rng = random.Random(seed)
+    words = model.Model.TESTWORDS
+    return [' '.join(rng.choice(words) for _ in range(max(1, int(rng.lognormvariate(1.8, 0.9)))))
+            for _ in range(count)]
+
+
+def contactsAndMessages(address, contacts, messages):
+    mdl = model.Model(address)
+    senders = [(common.loopback(i, base=254 * 40), address[1]) for i in range(contacts)]
+
+    before = current()
+    for sender in senders:
+        mdl.addContact({'from': sender, 'nickname': 'mem%d' % len(mdl.contacts)})
+    mdl.popChanges()
+    perContact = (current() - before) / contacts
+
+    #spread over contacts so MAX_HISTORY doesn't trim anything
+    perConvo = max(1, min(messages // contacts, config.MAX_HISTORY))
+    body = texts(perConvo)
+    before = current()
+    for sender in senders:
+        for text in body:
+            mdl.receiveMessage(inbound(sender, mdl.ADDRESS, text))
+        mdl.popChanges()
+    perMessage = (current() - before) / (perConvo * contacts)
+
+    common.stopServer(mdl.serverObject, mdl.ADDRESS)
+    return perContact, perMessage
+
+
+def connections(address, count):
+    server, _ = common.startServer(address)
+    gauge = metrics.gauge('server.connections')
+    base = gauge.read()
+
+    before = current()
+    socks = [socket.create_connection(address) for _ in range(count)]
+    deadline = time.monotonic() + 10
+    while gauge.read() - base < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    perConnection = (current() - before) / count
+
+    for sock in socks:
+        sock.close()
+    socks = None
+    deadline = time.monotonic() + 10
+    while gauge.read() > base and time.monotonic() < deadline:
+        time.sleep(0.01)
+        
+    #PigServer.listen() holds on to its last batch of select() events until
+    #the next one, so go round its loop once more before counting leftovers
+    socket.create_connection(address).close()
+    time.sleep(0.1)
+    left = (current() - before) / count
+
+    common.stopServer(server, address)
+    return perConnection, left
+
+
+def scanRounds(subnet, peers, rounds, port):
+    network = '127.0.%d.' % subnet
+    node = discovery.Node((network + '1', port))
+    others = [discovery.Node((network + str(2 + i), port)) for i in range(peers)]
+    everyone = [node] + others
+    for n in everyone:
+        common.waitListening(n.model.ADDRESS)
+
+    peaks, left = [], []
+    for r in range(rounds):
+        baseline = threading.active_count()
+        before = current()
+        tracemalloc.reset_peak()
+        node.scan((1, 255))
+        discovery.settle(everyone, baseline, 60)
+        peak = tracemalloc.get_traced_memory()[1]
+        peaks.append(peak - before)
+        if r >= SCAN_WARMUP:
+            left.append(current() - before)
+
+    for n in everyone:
+        n.stop()
+    return max(peaks), (statistics.median(left) if left else None)
+
+
+def soak(subnet, peers, rounds, warmup, port):
+    """Everyone scans and chats every round. Returns (growth per round, top growing lines)"""
+    saved = config.MAX_HISTORY, config.SEEN_IDS_MAX
+    config.MAX_HISTORY, config.SEEN_IDS_MAX = 5, 20
+
+    network = '127.0.%d.' % subnet
+    everyone = [discovery.Node((network + str(1 + i), port)) for i in range(peers + 1)]
+    node = everyone[0]
+    for n in everyone:
+        common.waitListening(n.model.ADDRESS)
+    body = texts(50)
+    nodekey = node.model.addressToString(node.model.ADDRESS)
+
+    def soakRound(r):
+        baseline = threading.active_count()
+        for n in everyone:
+            n.scan((1, 2 + peers))
+        discovery.settle(everyone, baseline, 60)
+        for i, n in enumerate(everyone[1:]):
+            peerkey = n.model.addressToString(n.model.ADDRESS)
+            with n.lock:
+                if nodekey in n.model.contacts:
+                    n.model.sendMessage(nodekey, body[(r + i) % len(body)])
+            with node.lock:
+                if peerkey in node.model.contacts:
+                    node.model.sendMessage(peerkey, body[(r * 7 + i) % len(body)])
+        discovery.settle(everyone, baseline, 60)
+        time.sleep(0.05)   #let the status queues drain through the node loops
+        discovery.settle(everyone, baseline, 60)
+
+    for r in range(warmup):
+        soakRound(r)
+    start = current()
+    first = tracemalloc.take_snapshot()
+    for r in range(warmup, warmup + rounds):
+        soakRound(r)
+    growth = (current() - start) / rounds
+    top = tracemalloc.take_snapshot().compare_to(first, 'lineno')[:5]
+
+    for n in everyone:
+        n.stop()
+    config.MAX_HISTORY, config.SEEN_IDS_MAX = saved
+    return growth, [str(stat) for stat in top]
+
+
+def canvasRows(messages, seed):
+    from bench import render
+    render.ensureDisplay()
+    import oink
+
+    mdl = model.Model((common.loopback(0, base=254 * 41), config.PORT))
+    mdl.fillTestData(1, messages, seed)
+    gui = oink.Gui(model=mdl)
+    gui.root.update()
+    gui.fromkey = mdl.ordered[0]
+    before = current()
+    gui.ConvoView()
+    gui.root.update()
+    perRow = (current() - before) / messages
+    gui.root.destroy()
+    common.stopServer(mdl.serverObject, mdl.ADDRESS)
+    return perRow
+
+
+def compare(values, baseline, tolerance):
+    """Names of values that got worse than baseline by more than tolerance"""
+    worse = []
+    for name, base in baseline.get('values', {}).items():
+        value = values.get(name)
+        if value is None or base is None:
+            continue
+        if value > base * (1 + tolerance) + SLACK:
+            worse.append(f"{name}: {value} vs baseline {base}")
+    return worse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory per contact/message/connection/scan")
+    parser.add_argument('--contacts', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--scan-peers', type=int, default=16)
+    parser.add_argument('--scan-rounds', type=int, default=10)
+    parser.add_argument('--soak-peers', type=int, default=8)
+    parser.add_argument('--soak-rounds', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=30, help="soak rounds before measuring")
+    parser.add_argument('--gui', action='store_true', help="also measure canvas rows (needs a display)")
+    parser.add_argument('--port', type=int, default=config.PORT)
+    parser.add_argument('--baseline', help="compare against this file, exit 1 on regressions")
+    parser.add_argument('--write-baseline', help="save this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed fraction worse")
+    parser.add_argument('--out', help="write json here instead of stdout")
+    args = parser.parse_args(argv)
+
+    tracemalloc.start(1)
+    values = {}
+    with common.quiet(False):
+        contact, message = contactsAndMessages((common.loopback(0, base=254 * 30), args.port),
+                                               args.contacts, args.messages)
+        values['contact_bytes'] = round(contact)
+        values['message_bytes'] = round(message)
+        print(f"contact={values['contact_bytes']}B message={values['message_bytes']}B", file=sys.stderr)
+
+        conn, left = connections((common.loopback(1, base=254 * 30), args.port), args.connections)
+        values['connection_bytes'] = round(conn)
+        values['connection_left_bytes'] = round(left)
+        print(f"connection={values['connection_bytes']}B left={values['connection_left_bytes']}B",
+              file=sys.stderr)
+
+        peak, left = scanRounds(120, args.scan_peers, args.scan_rounds, args.port)
+        values['scan_peak_bytes'] = peak
+        values['scan_left_bytes'] = None if left is None else round(left)
+        print(f"scan peak={peak}B left={values['scan_left_bytes']}B", file=sys.stderr)
+
+        growth, top = soak(121, args.soak_peers, args.soak_rounds, args.warmup, args.port)
+        values['soak_growth_bytes'] = round(growth)
+        print(f"soak growth={values['soak_growth_bytes']}B/round", file=sys.stderr)
+
+        if args.gui:
+            values['canvas_row_bytes'] = round(canvasRows(500, 1))
+
+    report = {'benchmark': 'memory', 'env': common.environment(),
+              'args': {k: v for k, v in vars(args).items()
+                       if k not in ('out', 'baseline', 'write_baseline')},
+              'values': values,
+              'soak_top_growth': top,
+             }
+
+    worse = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            worse = compare(values, json.load(f), args.tolerance)
+        report['regressions'] = worse
+        for line in worse:
+            print('REGRESSION', line, file=sys.stderr)
+
+    if args.write_baseline:
+        with open(args.write_baseline, 'w') as f:
+            json.dump({'env': report['env'], 'args': report['args'], 'values': values}, f, indent=2)
+            f.write('\n')
+
+    common.emit(report, args.out)
+    if worse:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
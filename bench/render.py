@@ -0,0 +1,177 @@
+#GUI rendering benchmark
+"""
+How long the Tk side takes to draw, for made up data of a given size.
+
+For every (contacts, messages per contact) combination we fill a Model
+with Model.fillTestData(), open a Gui on it (no scanning, no wakeup pipe)
+and time:
+
+    format_cold_ms      formatMessage() for every message in one convo, empty cache
+    format_warm_ms      same again, all cache hits
+    contacts_full_ms    ContactsView() from scratch, until Tk is idle
+    convo_full_ms       ConvoView() of the first conversation, until Tk is idle
+    convo_switch_ms     ConvoView() for other conversations, like clicking through them
+    incoming_ms         one inbound message through checkInQueue() + applyChanges()
+    scroll_ms           one screen of scrolling up through the open conversation
+
+Needs a display. If DISPLAY isn't set and Xvfb is installed, we start one
+for the run. Numbers from Xvfb are software rendering, so compare them
+with each other, not with a real desktop.
+
+    python -m bench.render
+    python -m bench.render --contacts 10 200 --messages 50 2000 --out render.json
+"""
+
+import os
+import sys
+import time
+import uuid
+import shutil
+import argparse
+import subprocess
+
+import config
+import model
+from bench import common
+
+
+def ensureDisplay(screen='1280x1024x24'):
+    """Returns an Xvfb process we started (kill it after), or None if there's already a display"""
+    if os.environ.get('DISPLAY') or sys.platform in ('win32', 'darwin'):
+        return None
+    if not shutil.which('Xvfb'):
+        sys.exit("no DISPLAY and no Xvfb to make one. Install xvfb or run this on a desktop")
+
+    for n in range(90, 100):
+        if os.path.exists('/tmp/.X11-unix/X%d' % n) or os.path.exists('/tmp/.X%d-lock' % n):
+            continue
+        proc = subprocess.Popen(['Xvfb', ':%d' % n, '-screen', '0', screen, '-nolisten', 'tcp'],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and proc.poll() is None:
+            if os.path.exists('/tmp/.X11-unix/X%d' % n):
+                os.environ['DISPLAY'] = ':%d' % n
+                return proc
+            time.sleep(0.05)
+        proc.kill()
+    sys.exit("couldn't start Xvfb")
+
+
+def timeit(fn, settle):
+    """Seconds for fn() plus however long Tk needs to get idle again"""
+    start = time.perf_counter()
+    fn()
+    settle()
+    return time.perf_counter() - start
+
+
+def inbound(mdl, fromkey, text):
+    """A message as it would come off the wire from fromkey"""
+    contact = mdl.contacts[fromkey]
+    return {'to':mdl.ADDRESS, 'from':contact['address'], 'timestamp':time.time(),
+            'text':text, 'id':uuid.uuid4().hex, 'nickname':contact['nickname']}
+
+
+def runOne(address, contacts, messages, repeat, incoming, seed):
+    import oink     #after ensureDisplay, Tk needs DISPLAY when the window opens
+
+    mdl = model.Model(address)
+    mdl.fillTestData(contacts, messages, seed)
+    gui = oink.Gui(model=mdl)
+    root = gui.root
+    root.geometry('1000x700')
+    root.update()
+    settle = root.update
+
+    own = mdl.addressToString(mdl.ADDRESS)
+    keys = [fromkey for fromkey in mdl.ordered if fromkey != own]
+    gui.fromkey = keys[0] if keys else own
+    texts = [msg['text'] for msg in mdl.messages[gui.fromkey]]
+    result = {'contacts': contacts, 'messages': messages}
+
+    #text layout on its own
+    cold, warm = [], []
+    for _ in range(repeat):
+        gui.layout.cache.clear()
+        cold.append(timeit(lambda: [gui.formatMessage(text) for text in texts], lambda: None))
+        warm.append(timeit(lambda: [gui.formatMessage(text) for text in texts], lambda: None))
+    result['format_cold_ms'] = common.summarize(cold)
+    result['format_warm_ms'] = common.summarize(warm)
+
+    #full renders
+    result['contacts_full_ms'] = common.summarize(
+        [timeit(gui.ContactsView, settle) for _ in range(repeat)])
+    result['convo_full_ms'] = common.summarize(
+        [timeit(gui.ConvoView, settle) for _ in range(repeat)])
+
+    switches = []
+    for fromkey in (keys[1:repeat + 1] or keys):
+        gui.fromkey = fromkey
+        switches.append(timeit(gui.ConvoView, settle))
+    result['convo_switch_ms'] = common.summarize(switches)
+
+    #incremental: new messages into the open conversation, same path as onWake()
+    gui.fromkey = keys[0] if keys else own
+    gui.ConvoView()
+    settle()
+    mdl.popChanges()
+    arrivals = []
+    for i in range(incoming if keys else 0):
+        msg = inbound(mdl, gui.fromkey, texts[i % len(texts)] if texts else 'hey')
+        def deliver():
+            mdl.inQueue.put(msg)
+            mdl.checkInQueue()
+            gui.applyChanges()
+        arrivals.append(timeit(deliver, settle))
+    result['incoming_ms'] = common.summarize(arrivals)
+
+    #scroll from bottom to top a screen at a time
+    canvas = gui.convoScroll
+    canvas.yview_moveto(1.0)
+    settle()
+    scrolls = []
+    while canvas.yview()[0] > 0 and len(scrolls) < 10000:
+        scrolls.append(timeit(lambda: canvas.yview_scroll(-1, 'pages'), settle))
+    result['scroll_ms'] = common.summarize(scrolls)
+    result['canvas_items'] = len(canvas.find_all())
+
+    root.destroy()
+    common.stopServer(mdl.serverObject, mdl.ADDRESS)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GUI rendering benchmark")
+    parser.add_argument('--contacts', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--messages', type=int, nargs='+', default=[50, 500],
+                        help="messages per contact")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--incoming', type=int, default=50, help="inbound messages to time")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=config.PORT)
+    parser.add_argument('--out', help="write json here instead of stdout")
+    args = parser.parse_args(argv)
+
+    xvfb = ensureDisplay()
+    runs = []
+    try:
+        with common.quiet(False):
+            for contacts in args.contacts:
+                for messages in args.messages:
+                    address = (common.loopback(len(runs), base=500), args.port)
+                    result = runOne(address, contacts, messages, args.repeat, args.incoming, args.seed)
+                    runs.append(result)
+                    print(f"contacts={contacts:<5} messages={messages:<6} "
+                          f"contacts_full={result['contacts_full_ms']['p50']}ms "
+                          f"convo_full={result['convo_full_ms']['p50']}ms "
+                          f"incoming={(result['incoming_ms'] or {}).get('p50')}ms", file=sys.stderr)
+    finally:
+        if xvfb:
+            xvfb.kill()
+
+    common.emit({'benchmark': 'render', 'env': common.environment(), 'xvfb': xvfb is not None,
+                 'seed': args.seed, 'runs': runs}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+#peer swarm simulator
+"""
+Load generator: hundreds of virtual peers in one process, all pointed at
+one Oink node. Each peer has its own 127.0.x.y address and speaks the real
+wire protocol (pigclient out, pigserverlibrary.SockData in), but peers
+aren't Models: they share one selector thread for all their listening
+sockets, one scheduler thread, and a fixed pool of sender threads. That's
+what lets a few hundred of them fit in one process.
+
+Every peer:
+    scans the target every --scan-interval seconds (jittered),
+    replies to the target's scans, like a real client would,
+    chats at --msg-rate messages/sec (Poisson), sizes from --sizes.
+
+The target is either a running node (--target ip;port, eg an oinkd) or,
+by default, a Model started here in process so the run is self contained.
+Progress goes to stderr every --report seconds, a json summary to stdout
+at the end.
+
+--sizes takes one of:
+    fixed:N             every message N chars
+    uniform:A:B         between A and B chars
+    lognormal:MU:SIGMA  lognormvariate(MU, SIGMA) chars, chat-like skew (default 3.4:0.9)
+
+    python -m bench.swarm --peers 200 --duration 60
+    python -m bench.swarm --peers 500 --msg-rate 0.5 --scan-interval 5 --sizes uniform:10:2000
+    python -m bench.swarm --target "127.0.0.7;49691" --peers 100 --duration 3600 --out soak.json
+"""
+
+import sys
+import time
+import uuid
+import heapq
+import socket
+import random
+import argparse
+import selectors
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import metrics
+from skt import pigclient
+from skt import pigserverlibrary
+from bench import common
+from bench import discovery
+
+
+def sizer(spec, rng):
+    """Message size distribution from its --sizes spec. Returns fn() -> chars"""
+    kind, *params = spec.split(':')
+    try:
+        if kind == 'fixed':
+            n = int(params[0])
+            return lambda: n
+        if kind == 'uniform':
+            a, b = int(params[0]), int(params[1])
+            return lambda: rng.randint(a, b)
+        if kind == 'lognormal':
+            mu, sigma = float(params[0]), float(params[1])
+            return lambda: max(1, int(rng.lognormvariate(mu, sigma)))
+    except (IndexError, ValueError):
+        pass
+    raise ValueError(f"bad size spec {spec!r}")
+
+
+class Peer:
+    """One virtual peer. SockData puts what it receives into us, like it would a queue"""
+
+    def __init__(self, swarm, address, nickname):
+        self.swarm = swarm
+        self.address = address
+        self.nickname = nickname
+
+    def put(self, msg):
+        if msg.get('text') == config.SCANKEY:
+            self.swarm.stats.inc('scans_in')
+            self.swarm.send(self, config.REPLKEY, 'replies_out')
+        elif msg.get('text') == config.REPLKEY:
+            self.swarm.stats.inc('replies_in')
+        else:
+            self.swarm.stats.inc('messages_in')
+
+    def message(self, text):
+        return {'to': self.swarm.target,
+                'from': self.address,
+                'timestamp': time.time(),
+                'text': text,
+                'id': uuid.uuid4().hex,
+                'nickname': self.nickname,
+               }
+
+
+class Stats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.latency = metrics.Histogram()   #bounded memory for long soaks
+        self.inflight = 0
+        self.peakInflight = 0
+
+    def inc(self, name, n=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def get(self, name):
+        return self.counts.get(name, 0)
+
+
+class Swarm:
+
+    def __init__(self, target, peers, base, port, workers, timeout):
+        self.target = target
+        self.timeout = timeout
+        self.stats = Stats()
+        self.running = True
+        self.sel = selectors.DefaultSelector()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='swarmSend')
+        self.peers = []
+        for i in range(peers):
+            peer = Peer(self, (common.loopback(i, base), port), 'swarm%d' % i)
+            lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            lsock.bind(peer.address)
+            lsock.listen()
+            lsock.setblocking(False)
+            self.sel.register(lsock, selectors.EVENT_READ, data=peer)
+            self.peers.append(peer)
+        self.listener = threading.Thread(target=self.listen, name='swarmListen', daemon=True)
+        self.listener.start()
+
+    def listen(self):
+        """PigServer.listen(), but for every peer's socket at once"""
+        while self.running:
+            for key, mask in self.sel.select(timeout=0.2):
+                if isinstance(key.data, Peer):
+                    try:
+                        conn, addr = key.fileobj.accept()
+                    except BlockingIOError:
+                        continue
+                    conn.setblocking(False)
+                    sockdata = pigserverlibrary.SockData(self.sel, conn, addr, key.data)
+                    self.sel.register(conn, selectors.EVENT_READ, data=sockdata)
+                else:
+                    try:
+                        key.data.process_events(mask)
+                    except Exception:
+                        self.stats.inc('receive_errors')
+                        key.data.close()
+        for key in list(self.sel.get_map().values()):
+            key.fileobj.close()
+        self.sel.close()
+
+    def send(self, peer, text, counter):
+        """Queue a send from peer to the target on the sender pool"""
+        msg = peer.message(text)
+        with self.stats.lock:
+            self.stats.inflight += 1
+            self.stats.peakInflight = max(self.stats.peakInflight, self.stats.inflight)
+        self.pool.submit(self.deliver, msg, counter)
+
+    def deliver(self, msg, counter):
+        start = time.perf_counter()
+        try:
+            acked = pigclient.acked(pigclient.sendMessage(self.target, msg, self.timeout))
+        except Exception:
+            traceback.print_exc()
+            acked = False
+        ms = (time.perf_counter() - start) * 1000
+        self.stats.inc(counter)
+        self.stats.inc('acked' if acked else 'failed')
+        if acked:
+            self.stats.latency.observe(ms)
+        with self.stats.lock:
+            self.stats.inflight -= 1
+
+    def run(self, duration, scanInterval, msgRate, size, rng, report, probe=None):
+        """Scheduler loop: one heap of (due, seq, what, peer) for every peer's next action"""
+        start = time.monotonic()
+        end = start + duration
+        heap = []
+        seq = 0
+        for peer in self.peers:
+            if scanInterval:
+                heap.append((start + rng.uniform(0, scanInterval), seq, 'scan', peer))
+                seq += 1
+            if msgRate:
+                heap.append((start + rng.expovariate(msgRate), seq, 'chat', peer))
+                seq += 1
+        heapq.heapify(heap)
+
+        nextReport = start + report
+        samples = []
+        while heap:
+            due, _, what, peer = heap[0]
+            now = time.monotonic()
+            if now >= nextReport:
+                samples.append(self.progress(now - start, probe))
+                nextReport += report
+            if due >= end:
+                break
+            if due > now:
+                time.sleep(min(due - now, nextReport - now, 0.05))
+                continue
+
+            heapq.heappop(heap)
+            if what == 'scan':
+                self.send(peer, config.SCANKEY, 'scans_out')
+                due += scanInterval * rng.uniform(0.5, 1.5)
+            else:
+                self.send(peer, 'x' * size(), 'messages_out')
+                due += rng.expovariate(msgRate)
+            heapq.heappush(heap, (due, seq, what, peer))
+            seq += 1
+
+        #wait for what's already queued, give replies a moment to land
+        time.sleep(max(0, end - time.monotonic()))
+        self.pool.shutdown(wait=True)
+        time.sleep(0.5)
+        self.running = False
+        self.listener.join()
+        return samples
+
+    def progress(self, elapsed, probe):
+        s = self.stats
+        sample = {'t': round(elapsed, 1),
+                  'sent': s.get('scans_out') + s.get('messages_out') + s.get('replies_out'),
+                  'acked': s.get('acked'),
+                  'failed': s.get('failed'),
+                  'received': s.get('scans_in') + s.get('replies_in') + s.get('messages_in'),
+                  'inflight': s.inflight,
+                  'p50_ms': round(s.latency.percentile(50) or 0, 2),
+                  'p99_ms': round(s.latency.percentile(99) or 0, 2),
+                 }
+        if probe:
+            sample.update(probe())
+        print(' '.join(f'{k}={v}' for k, v in sample.items()), file=sys.stderr)
+        return sample
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Virtual peer swarm against one Oink node")
+    parser.add_argument('--peers', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30, help="seconds")
+    parser.add_argument('--scan-interval', type=float, default=config.SCAN_MIN / 1000,
+                        help="seconds between each peer's scans, 0 for none")
+    parser.add_argument('--msg-rate', type=float, default=0.2,
+                        help="messages/sec per peer, 0 for none")
+    parser.add_argument('--sizes', default='lognormal:3.4:0.9')
+    parser.add_argument('--target', help="ip;port of a running node. Default starts one here")
+    parser.add_argument('--workers', type=int, default=64, help="sender threads shared by all peers")
+    parser.add_argument('--timeout', type=float, default=config.SEND_TIMEOUT)
+    parser.add_argument('--port', type=int, default=config.PORT)
+    parser.add_argument('--base', type=int, default=254 * 10, help="first peer is loopback(0, base)")
+    parser.add_argument('--report', type=float, default=5, help="seconds between progress lines")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true', help="show Model's prints on stderr")
+    parser.add_argument('--out', help="write json here instead of stdout")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    try:
+        size = sizer(args.sizes, rng)
+    except ValueError as e:
+        parser.error(str(e))
+
+    with common.quiet(args.verbose):
+        node = None
+        probe = None
+        if args.target:
+            ip, port = args.target.split(';')
+            target = (ip, int(port))
+        else:
+            target = ('127.0.250.1', args.port)
+            node = discovery.Node(target)
+            common.waitListening(target)
+            probe = lambda: {'target_queue': node.model.inQueue.qsize(),
+                             'target_contacts': len(node.model.contacts) - 1}
+
+        swarm = Swarm(target, args.peers, args.base, args.port, args.workers, args.timeout)
+        with common.Sampler() as sampler:
+            cpu = time.process_time()
+            started = time.perf_counter()
+            samples = swarm.run(args.duration, args.scan_interval, args.msg_rate, size,
+                                rng, args.report, probe)
+            wall = time.perf_counter() - started
+            cpu = time.process_time() - cpu
+        if node:
+            node.stop()
+
+    s = swarm.stats
+    report = {'benchmark': 'swarm', 'env': common.environment(),
+              'args': {k: v for k, v in vars(args).items() if k not in ('out', 'verbose')},
+              'seconds': round(wall, 3),
+              'counts': dict(sorted(s.counts.items())),
+              'send_ms': s.latency.read(),
+              'peak_inflight': s.peakInflight,
+              'peak_threads': sampler.peakThreads,
+              'peak_fds': sampler.peakFds,
+              'cpu_seconds': round(cpu, 3),
+              'progress': samples,
+             }
+    if node:
+        report['target'] = {'received': node.received,
+                            'contacts': len(node.model.contacts) - 1,
+                            'messages': sum(len(m) for m in node.model.messages.values())}
+    common.emit(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#transport benchmark
+"""
+Loopback throughput and latency of the skt transport:
+pigclient.sendMessage() -> PigServer.listen() -> inQueue.
+
+For every (senders, size) combination we start a fresh PigServer on its 
+own 127.0.0.x address, and `senders` threads each send `count` messages 
+back to back, one connection per message like the app does. A consumer 
+thread drains the queue as messages land. Reported per run:
+
+    msgs/sec, end-to-end latency (sendMessage call -> out of the queue),
+    CPU time used by the process, peak fds and threads, failed sends.
+
+    python -m bench.transport
+    python -m bench.transport --senders 1 8 32 --sizes 64 4096 65536 --count 200 --out transport.json
+"""
+
+import time
+import queue
+import argparse
+import threading
+
+import config
+from skt import pigclient
+from bench import common
+
+
+def runOne(address, senders, size, count, timeout):
+    server, inQueue = common.startServer(address)
+    payload = 'x' * size
+    latencies = []
+    failures = []
+    sendersDone = threading.Event()
+    
+    def consume():
+        #stop once everything that was acked has come out the other end
+        while not (sendersDone.is_set() and len(latencies) >= senders*count - len(failures)):
+            try:
+                msg = inQueue.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if 'sent' in msg:
+                latencies.append(time.perf_counter() - msg['sent'])
+        
+    def send(sender):
+        for i in range(count):
+            msg = {'text': payload, 'sender': sender, 'seq': i, 'sent': time.perf_counter()}
+            if not pigclient.acked(pigclient.sendMessage(address, msg, timeout)):
+                failures.append((sender, i))
+                
+    consumer = threading.Thread(target=consume, daemon=True)
+    threads = [threading.Thread(target=send, args=(n,), daemon=True) for n in range(senders)]
+    
+    with common.Sampler() as sampler:
+        cpu = time.process_time()
+        start = time.perf_counter()
+        consumer.start()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        sendersDone.set()
+        consumer.join()
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+    
+    common.stopServer(server, address)
+    return {'senders': senders,
+            'size': size,
+            'sent': senders * count,
+            'received': len(latencies),
+            'failed': len(failures),
+            'seconds': round(wall, 4),
+            'msgs_per_sec': round(len(latencies) / wall, 1) if wall else None,
+            'latency_ms': common.summarize(latencies),
+            'cpu_seconds': round(cpu, 4),
+            'peak_threads': sampler.peakThreads,
+            'peak_fds': sampler.peakFds,
+           }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="skt transport loopback benchmark")
+    parser.add_argument('--senders', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 1024, 16384])
+    parser.add_argument('--count', type=int, default=100, help="messages per sender")
+    parser.add_argument('--timeout', type=float, default=config.SEND_TIMEOUT)
+    parser.add_argument('--port', type=int, default=config.PORT)
+    parser.add_argument('--out', help="write json here instead of stdout")
+    args = parser.parse_args(argv)
+    
+    runs = []
+    with common.quiet():
+        for senders in args.senders:
+            for size in args.sizes:
+                address = (common.loopback(len(runs), base=200), args.port)
+                result = runOne(address, senders, size, args.count, args.timeout)
+                runs.append(result)
+                print(f"senders={senders:<4} size={size:<7} "
+                      f"{result['msgs_per_sec']} msg/s  "
+                      f"p50={result['latency_ms']['p50']}ms p99={result['latency_ms']['p99']}ms  "
+                      f"failed={result['failed']}")
+                
+    common.emit({'benchmark': 'transport', 'env': common.environment(),
+                 'count': args.count, 'runs': runs}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#cadence class
+
+import time
+
+
+class Cadence:
+    """
+    An interval (in ms) for something that runs on a timer, like polling 
+    or scanning. Each next() hands out the current interval and then backs 
+    off, so the longer nothing happens the less often we run, up to ceiling. 
+    activity() drops it straight back to floor, idle() jumps to ceiling 
+    (eg when the window loses focus).
+    
+    We also remember when the run we last handed out an interval for is due, 
+    so activity() only asks for a reschedule when the floor would get there 
+    sooner. Otherwise a steady stream of activity would keep pushing the 
+    next run back and it would never happen.
+    """
+    def __init__(self, floor, ceiling, backoff=1.5):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.backoff = backoff
+        self.interval = floor
+        self.due = None     #monotonic time the scheduled run is due
+        
+    def next(self):
+        interval = self.interval
+        self.interval = min(self.ceiling, self.interval * self.backoff)
+        self.due = time.monotonic() + interval / 1000
+        return int(interval)
+        
+    def activity(self):
+        """
+        Back to floor. Returns ms to reschedule the pending run at, if that's 
+        sooner than when it's due, else None. Doesn't count as a backoff step.
+        """
+        self.interval = self.floor
+        due = time.monotonic() + self.floor / 1000
+        if self.due is not None and due >= self.due:
+            return None
+        self.due = due
+        return int(self.floor)
+        
+    def idle(self):
+        self.interval = self.ceiling
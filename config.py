@@ -7,4 +7,56 @@ SCANKEY = 'h5j4kl3h6k4l3'
 REPLKEY = 'htklsaehgk135'
 
 NICKNAME = None     #Put name in quotes to set nickname
-DARKMODE = False     #True or False
\ No newline at end of file
+DARKMODE = False     #True or False
+
+#presence and memory limits
+PRESENCE_LEASE = 15      #seconds a scan/reply/message keeps a contact online
+EVICT_AFTER = 300        #seconds offline before a contact is dropped
+MAX_HISTORY = 500        #messages kept in memory per conversation
+HISTORY_DIR = None       #folder to spill old messages into. None just drops them
+
+#discovery. Scan replies carry a list of peers the replier knows, so we can
+#scan just those, and only sweep the whole /24 every SWEEP_EVERY rounds
+PEER_EXCHANGE = True     #send and use peer lists. False sweeps every round like before
+PEX_MAX = 50             #peers listed per reply
+SWEEP_EVERY = 12         #full subnet sweep every this many scan rounds (1 = every round)
+
+#outbound delivery
+SEND_TIMEOUT = 3         #seconds one send attempt waits for an ack
+SEND_DEADLINE = 20       #seconds of retrying before an unacked message goes to the outbox
+SEND_RETRIES = 3         #extra attempts after the first one fails
+SEND_BACKOFF = 0.5       #seconds before first retry, doubles each time
+FANOUT_LIMIT = 32        #connections open at once when sending to a group
+
+#store-and-forward for peers that are offline
+OUTBOX_MAX = 200         #undelivered messages held per peer. 0 turns the outbox off
+OUTBOX_BATCH = 50        #messages sent per connection when flushing
+SEEN_IDS_MAX = 10000     #message ids remembered for dropping duplicates
+CAPTURE_FILE = None      #record all inbound traffic here for replay, see skt/capture.py
+
+#runtime metrics, see metrics.py. Both off by default
+METRICS_PORT = None      #serve json on http://127.0.0.1:PORT/metrics
+METRICS_DUMP = None      #file to append a json snapshot to
+METRICS_DUMP_EVERY = 60  #seconds between dumps
+
+#profiling, see profiling.py. Can also be switched on while running
+PROFILE = False          #time hot paths into metrics (span.*) and log slow Tk callbacks
+PROFILE_WINDOW = 0       #seconds of cProfile on the GUI/daemon loop at startup, 0 for none
+PROFILE_EVERY = 0        #seconds between further cProfile windows, 0 for just the one
+PROFILE_DIR = 'profiles' #where .pstats files go
+SLOW_MS = 100            #Tk callbacks blocking longer than this get logged
+SLOW_LOG = None          #file for the slow log. None prints it
+
+#GUI
+WINDOWED_CONVO = True    #only draw messages near the visible part of a conversation
+LAYOUT_CACHE_SIZE = 5000 #wrapped message layouts kept around for redraws
+TEST_CONTACTS = 0        #fill in this many made up contacts on startup, for trying out the GUI
+TEST_MESSAGES = 40       #made up messages per test contact
+
+#timer cadence in ms. Fast while you're using the app or messages come in,
+#backs off toward the max while idle, and jumps to the max when unfocused
+POLL_MIN = 250           #only used where the GUI can't be woken up directly
+POLL_MAX = 5000
+SCAN_MIN = 5000
+SCAN_MAX = 60000
+CADENCE_BACKOFF = 1.5    #interval multiplier each idle round
\ No newline at end of file
@@ -0,0 +1,228 @@
+#metrics
+"""
+Counters, gauges and histograms that pigclient, PigServer, Model and the
+Gui bump as they run, so we can see what a node is doing without turning
+on VERBOSE everywhere.
+
+Modules grab their metrics once at import (or in __init__) and just call
+inc()/observe() after that, which is a lock and an add. Gauges that are
+really just "current size of X" are registered as functions instead, so
+they cost nothing until someone reads them.
+
+Nothing leaves the process unless config asks for it:
+    METRICS_PORT    serve snapshot() as json on http://127.0.0.1:PORT/metrics
+    METRICS_DUMP    append a snapshot() line to this file every METRICS_DUMP_EVERY seconds
+Both are started by start(), which the GUI and oinkd call on startup.
+"""
+
+import json
+import time
+import bisect
+import threading
+import http.server
+
+import config
+
+
+#default histogram buckets, in ms
+TIMEBUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Counter:
+    """Only goes up"""
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def read(self):
+        return self.value
+
+
+class Gauge:
+    """Goes up and down, or is read from fn() when there is one"""
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def dec(self, n=1):
+        with self.lock:
+            self.value -= n
+
+    def set(self, value):
+        self.value = value
+
+    def read(self):
+        if self.fn is None:
+            return self.value
+        try:
+            return self.fn()
+        except Exception:
+            return None     #whatever fn looks at might be mid-teardown
+
+
+class Histogram:
+    """Bucketed counts of observed values. Percentiles are bucket upper bounds"""
+
+    def __init__(self, buckets=TIMEBUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)     #last one is overflow
+        self.count = 0
+        self.total = 0
+        self.max = None
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def time(self):
+        """with histogram.time(): ... observes elapsed ms"""
+        return Timer(self)
+
+    def percentile(self, pct):
+        if not self.count:
+            return None
+        rank = pct / 100 * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def read(self):
+        return {'count': self.count,
+                'mean': round(self.total / self.count, 3) if self.count else None,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'max': self.max,
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['inf'], self.counts)),
+               }
+
+
+class Timer:
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe((time.perf_counter() - self.start) * 1000)
+
+
+class Registry:
+    """Metrics by name. Asking for the same name twice gets the same object"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def get(self, name, kind, *args):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = kind(*args)
+            return metric
+
+    def counter(self, name):
+        return self.get(name, Counter)
+
+    def gauge(self, name, fn=None):
+        gauge = self.get(name, Gauge)
+        if fn is not None:
+            gauge.fn = fn   #latest owner wins, eg Model after setOwnAddress
+        return gauge
+
+    def histogram(self, name, buckets=TIMEBUCKETS):
+        return self.get(name, Histogram, buckets)
+
+    def snapshot(self):
+        with self.lock:
+            items = sorted(self.metrics.items())
+        return {'time': time.time(),
+                'uptime': round(time.time() - self.started, 3),
+                'metrics': {name: metric.read() for name, metric in items},
+               }
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+snapshot = REGISTRY.snapshot
+
+
+
+#-------------Getting them out-----------#
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = json.dumps(snapshot(), indent=1).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass    #no line per scrape
+
+
+def serve(port, host='127.0.0.1'):
+    """Serve snapshots over HTTP from a daemon thread. Returns the server"""
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metricsServer', daemon=True).start()
+    print(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def dumpEvery(path, seconds):
+    """Append one json snapshot line to path every so often, from a daemon thread"""
+    def loop():
+        while True:
+            time.sleep(seconds)
+            with open(path, 'a') as f:
+                f.write(json.dumps(snapshot()) + '\n')
+    threading.Thread(target=loop, name='metricsDump', daemon=True).start()
+
+
+started = False
+
+def start():
+    """Start whatever config asks for. Safe to call more than once"""
+    global started
+    if started:
+        return
+    started = True
+    if config.METRICS_PORT:
+        try:
+            serve(config.METRICS_PORT)
+        except OSError as e:
+            print(f"cant serve metrics on port {config.METRICS_PORT}: {e}")
+    if config.METRICS_DUMP:
+        dumpEvery(config.METRICS_DUMP, config.METRICS_DUMP_EVERY)
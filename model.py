@@ -13,19 +13,98 @@ import threading
 import queue
 import time
 import socket
+import json
+import os
+import uuid
+import random
+import bisect
+from collections import OrderedDict
 
 import config
+import metrics
+import profiling
 from skt import pigclient
 from skt import pigserver 
 from skt import pigserver
+from skt import capture
 
 
 
+class WakeQueue(queue.SimpleQueue):
+    """
+    SimpleQueue that calls wakeup() after every put. The server thread puts 
+    incoming messages in here, so whoever is running Model (GUI, daemon) 
+    gets poked right away instead of having to poll.
+    """
+    wakeup = None
+    
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        if self.wakeup:
+            self.wakeup()
+        
+
+
+class Delivery:
+    """
+    Handle for one outbound message, returned by Model.sendMessage(). 
+    
+    State starts 'pending' and ends up 'acked' or 'failed'. The worker thread 
+    sets it and then hands the delivery back to Model through statusQueue, 
+    so the GUI can pick up the change on its next poll. Anyone else can 
+    just wait() on it.
+    
+    If we run out of retries and the outbox has room, the delivery is 
+    'queued' instead of failed, and stays pending until the peer shows up 
+    again and the outbox is flushed.
+    """
+    PENDING = 'pending'
+    QUEUED = 'queued'
+    ACKED = 'acked'
+    FAILED = 'failed'
+    
+    def __init__(self, fromkey, msg, deadline, address=None, groupkey=None):
+        self.fromkey = fromkey
+        self.groupkey = groupkey    #set when this is one member's share of a group message
+        self.msg = msg      #our local copy, shown in the conversation
+        self.payload = {k: v for k, v in msg.items() if k not in ('status', 'statuses')}
+        self.address = address or msg['to']
+        self.deadline = time.monotonic() + deadline
+        self.state = self.PENDING
+        self.attempts = 0
+        self._done = threading.Event()
+        
+    def done(self):
+        return self._done.is_set()
+    
+    def wait(self, timeout=None):
+        """Block until acked/failed (or timeout), returns state"""
+        self._done.wait(timeout)
+        return self.state
+    
+    def finish(self, state):
+        self.state = state
+        self._done.set()
+        
+
+
+MESSAGES_IN = metrics.counter('model.messages_in')
+MESSAGES_OUT = metrics.counter('model.messages_out')
+DUPLICATES = metrics.counter('model.duplicates')
+SCANS_IN = metrics.counter('model.scans_in')
+SCAN_MS = metrics.histogram('model.scan_ms')
+DELIVERIES = {state: metrics.counter('model.delivery_' + state) 
+              for state in (Delivery.QUEUED, Delivery.ACKED, Delivery.FAILED)}
+
+
 class Model:
 
-    def __init__(self):
+    def __init__(self, address=None):
     
-        if config.USE_LOCALHOST:
+        #address can be given as (ip, port), otherwise picked from config
+        if address:
+            self.ADDRESS = tuple(address)
+        elif config.USE_LOCALHOST:
             self.ADDRESS = (self.getLoopbackIP(), config.PORT)
         else:
             self.ADDRESS = (self.getIP(), config.PORT)
@@ -33,23 +112,37 @@ class Model:
         self.SCANKEY = config.SCANKEY
         self.REPLKEY = config.REPLKEY
         
-        self.contacts = {self.addressToString(self.ADDRESS):{"address":self.ADDRESS, "nickname":"Self"}}
+        self.contacts = {self.addressToString(self.ADDRESS):{"address":self.ADDRESS, "nickname":"Self", "online":True}}
         self.messages = {self.addressToString(self.ADDRESS):[]}
         self.ordered = list(self.contacts.keys())
+        self.seen = OrderedDict()   #recent message ids, oldest first
+        self.probed = {}            #fromkey -> when we last scanned it because a peer listed it
+        self.rounds = 0             #discover() rounds so far
         
         #for testing
-        if False:
-            self.fillTestData()
-            self.ADDRESS = (self.getLoopbackIP(), config.PORT)
-            self.ordered = list(self.contacts.keys())
+        if config.TEST_CONTACTS:
+            self.fillTestData(config.TEST_CONTACTS, config.TEST_MESSAGES)
         
         #for server 
         self.serverObject = pigserver.PigServer()
-        self.inQueue = queue.SimpleQueue()
+        self.inQueue = WakeQueue()
+        self.statusQueue = WakeQueue()  #lists of finished Delivery objects
+        self.outbox = {}        #fromkey -> list of queued Deliveries, oldest first
+        self.flushing = set()   #fromkeys with an outbox flush in flight
         self.serverThread = None
+        if config.CAPTURE_FILE:
+            capture.start(config.CAPTURE_FILE)
         self.startServer()
         
-        self.updated = False
+        #change tracking. GUI drains this with popChanges() each poll
+        self.activeKey = self.addressToString(self.ADDRESS)
+        self.unread = {}
+        self.resetChanges()
+        
+        #read only when someone looks at metrics
+        metrics.gauge('model.inqueue_depth', self.inQueue.qsize)
+        metrics.gauge('model.contacts', lambda: len(self.contacts))
+        metrics.gauge('model.outbox', lambda: sum(map(len, self.outbox.values())))
         
         
       
@@ -78,10 +171,15 @@ class Model:
         
         #update self contact
         self.contacts.pop(old)
-        self.contacts[address] = {"address":self.stringToAddress(address), "nickname":"Self"}
+        self.contacts[address] = {"address":self.stringToAddress(address), "nickname":"Self", "online":True}
         
         #move conversation over
         self.messages[address] = self.messages.pop(old)
+        self.ordered[self.ordered.index(old)] = address
+        if self.activeKey == old:
+            self.activeKey = address
+        self.changes['removed'].add(old)
+        self.changes['added'].add(address)
         
         self.startServer()
 
@@ -106,8 +204,16 @@ class Model:
         
     
 
+    def setWakeup(self, wakeup):
+        """wakeup() gets called (from other threads!) whenever there's something to check"""
+        self.inQueue.wakeup = wakeup
+        self.statusQueue.wakeup = wakeup
+        
+    
+
     #---------------Message / conversations---------------#
     
+    @profiling.span('model.checkInQueue')
     def checkInQueue(self):
         #this lives on tk after() loop in GUI, just checks for updates in queue
         newMsgs = self.inQueue.qsize()
@@ -119,23 +225,33 @@ class Model:
                 print('Queue empty, couldnt get')
             else:
                 if msg['text'] == self.SCANKEY or msg['text'] == self.REPLKEY:
+                    SCANS_IN.inc()
                     self.receiveScan(msg)
                 else:
                     self.receiveMessage(msg)
+                    
+        #also pick up results of our own sends
+        while not self.statusQueue.empty():
+            self.deliveryDone(self.statusQueue.get(block=False))
                 
-    def sendMessage(self, fromkey, text):
-    
-        self.updated = True
+    def sendMessage(self, fromkey, text, deadline=None):
+        """Returns a Delivery handle (a list of them for groups). Sending/retrying happens in background"""
+        if self.isGroup(fromkey):
+            return self.sendGroup(fromkey, text, deadline)
     
         #create message dict
         m = {'to':self.contacts[fromkey]['address'], 
              'from':self.ADDRESS, 
              'timestamp': time.time(),
              'text':text,
+             'id':uuid.uuid4().hex,
             }
+        self.markSeen(m['id'])
+        MESSAGES_OUT.inc()
+        delivery = Delivery(fromkey, m, deadline or config.SEND_DEADLINE)
             
         #add to our side of conversation
-        self.messages[fromkey].append(m) 
+        self.insertMessage(fromkey, m)
         
         #now we have to reorder orderd list 
         try:
@@ -145,12 +261,259 @@ class Model:
             pass 
         self.ordered.insert(0, fromkey)
     
+        #if older messages are still waiting on this peer, get in line behind them
+        if self.outbox.get(fromkey):
+            self.queueOutbound(delivery)
+            return delivery
+        m['status'] = delivery.state
+    
         #create new thread to call lower-level
         temp = threading.Thread(
-            target=pigclient.sendMessage,
-            args=(self.contacts[fromkey]['address'], m),
+            target=self.deliver,
+            args=(delivery,),
+            daemon=True,
         )
         temp.start()
+        return delivery
+        
+    def deliver(self, delivery):
+        """Runs in its own thread. Retry with backoff until acked or out of time"""
+        backoff = config.SEND_BACKOFF
+        state = Delivery.QUEUED
+        
+        #always report back, even if something blows up, or it stays pending forever
+        try:
+            while True:
+                delivery.attempts += 1
+                timeout = min(config.SEND_TIMEOUT, delivery.deadline - time.monotonic())
+                if pigclient.acked(pigclient.sendMessage(delivery.address, delivery.payload, timeout)):
+                    state = Delivery.ACKED
+                    break
+                    
+                #out of attempts, or no time left for another one. Outbox gets it next
+                if (delivery.attempts > config.SEND_RETRIES or 
+                        time.monotonic() + backoff >= delivery.deadline):
+                    break
+                time.sleep(backoff)
+                backoff *= 2
+        finally:
+            if state == Delivery.ACKED:
+                delivery.finish(state)
+            else:
+                delivery.state = state
+            self.statusQueue.put([delivery])
+        
+    def deliveryDone(self, deliveries):
+        """Main thread side of deliver()/deliverBatch(). Update outbox and status"""
+        for delivery in deliveries:
+            fromkey = delivery.fromkey
+            outbox = self.outbox.get(fromkey, [])
+            
+            if delivery in outbox:
+                #came back from a flush
+                self.flushing.discard(fromkey)
+                if delivery.state == Delivery.ACKED:
+                    outbox.remove(delivery)
+            elif delivery.state == Delivery.QUEUED:
+                self.queueOutbound(delivery)
+                
+            self.setStatus(delivery)
+            DELIVERIES[delivery.state].inc()
+            
+        #a successful flush might have left more behind it
+        if delivery.state == Delivery.ACKED:
+            self.flushOutbox(fromkey)
+   
+   
+   
+    #------------------Outbox--------------#
+    """Messages we couldn't deliver wait here, per peer, in the order they 
+    were sent. When we hear from that peer again (scan, reply or message) 
+    we flush the outbox, up to config.OUTBOX_BATCH messages per connection. 
+    Nothing is dropped unless the outbox is full (config.OUTBOX_MAX), in 
+    which case the new message fails.
+    """
+    
+    def queueOutbound(self, delivery):
+        outbox = self.outbox.setdefault(delivery.fromkey, [])
+        if len(outbox) >= config.OUTBOX_MAX:
+            delivery.finish(Delivery.FAILED)
+        else:
+            delivery.state = Delivery.QUEUED
+            outbox.append(delivery)
+            outbox.sort(key=lambda d: d.msg['timestamp'])
+        self.setStatus(delivery)
+    
+    def flushOutbox(self, fromkey):
+        outbox = self.outbox.get(fromkey)
+        if not outbox:
+            self.outbox.pop(fromkey, None)
+            return
+        if fromkey in self.flushing or fromkey not in self.contacts:
+            return
+            
+        batch = outbox[:config.OUTBOX_BATCH]
+        for delivery in batch:
+            delivery.state = Delivery.PENDING
+            self.setStatus(delivery)
+        self.flushing.add(fromkey)
+        
+        threading.Thread(
+            target=self.deliverBatch,
+            args=(self.contacts[fromkey]['address'], batch),
+            daemon=True,
+        ).start()
+    
+    def deliverBatch(self, address, batch):
+        """Runs in its own thread. One attempt, whole batch on one connection"""
+        payloads = [delivery.payload for delivery in batch]
+        response = pigclient.sendBatch(address, payloads, config.SEND_TIMEOUT)
+        if pigclient.acked(response):
+            acked = [True] * len(batch)
+        elif response is not None:
+            #they answered but didn't take it, eg an older version without 
+            #batches. Send them one at a time instead
+            acked = [pigclient.acked(pigclient.sendMessage(address, payload, config.SEND_TIMEOUT))
+                     for payload in payloads]
+        else:
+            acked = [False] * len(batch)
+        
+        for delivery, ok in zip(batch, acked):
+            delivery.attempts += 1
+            if ok:
+                delivery.finish(Delivery.ACKED)
+            else:
+                delivery.state = Delivery.QUEUED
+        self.statusQueue.put(batch)
+   
+    def setStatus(self, delivery):
+        """Show a delivery's state on its message. Group messages show the least done member"""
+        msg = delivery.msg
+        if delivery.groupkey is None:
+            msg['status'] = delivery.state
+            self.changes['status'].add(delivery.fromkey)
+            return
+        msg['statuses'][delivery.fromkey] = delivery.state
+        states = set(msg['statuses'].values())
+        for state in (Delivery.PENDING, Delivery.QUEUED, Delivery.FAILED, Delivery.ACKED):
+            if state in states:
+                msg['status'] = state
+                break
+        self.changes['status'].add(delivery.groupkey)
+   
+   
+   
+    #------------------Groups--------------#
+    """A group is a contact with 'members' (fromkeys) instead of an address, 
+    and its own conversation. Sending to it encodes the message once and 
+    fans it out to every member from one thread (pigclient.sendMany), at 
+    most config.FANOUT_LIMIT connections at a time. Each member gets its 
+    own Delivery, so status is per member: members that still haven't 
+    acked after the usual retries go to their own outbox like any other 
+    message, and the message shows the least far along of its members' 
+    states.
+    
+    Group messages carry the group's id, name and member addresses, so the 
+    other members file them (and can reply) under the same group.
+    """
+    
+    def isGroup(self, fromkey):
+        return 'members' in self.contacts.get(fromkey, ())
+    
+    def createGroup(self, name, members, groupkey=None):
+        """members are fromkeys. Returns the new group's key"""
+        groupkey = groupkey or 'group;' + uuid.uuid4().hex
+        own = self.addressToString(self.ADDRESS)
+        self.contacts[groupkey] = {'address':None, 'nickname':name, 'online':True,
+                                   'members':[m for m in dict.fromkeys(members) if m != own]}
+        self.messages[groupkey] = []
+        self.ordered.insert(0, groupkey)
+        self.changes['added'].add(groupkey)
+        return groupkey
+        
+    def joinGroup(self, info, fromkey):
+        """Someone sent us a group message. Make sure we have that group, return its key"""
+        groupkey = info['id']
+        if groupkey not in self.contacts:
+            members = [self.addressToString(a) for a in info['members']]
+            self.createGroup(info.get('name', 'group'), members + [fromkey], groupkey)
+        return groupkey
+    
+    def sendGroup(self, groupkey, text, deadline=None):
+        """Returns one Delivery per member"""
+        group = self.contacts[groupkey]
+        m = {'to':groupkey, 
+             'from':self.ADDRESS, 
+             'timestamp': time.time(),
+             'text':text,
+             'id':uuid.uuid4().hex,
+             'group':{'id':groupkey, 'name':group['nickname'],
+                      'members':[self.stringToAddress(k) for k in group['members']] + [self.ADDRESS]},
+             'statuses':{},
+            }
+        self.markSeen(m['id'])
+        MESSAGES_OUT.inc()
+        self.insertMessage(groupkey, m)
+        self.ordered.remove(groupkey)
+        self.ordered.insert(0, groupkey)
+        
+        deliveries = [Delivery(member, m, deadline or config.SEND_DEADLINE, 
+                               self.stringToAddress(member), groupkey) 
+                      for member in group['members']]
+        
+        #members with older messages waiting get in line, the rest go out now
+        now = []
+        for delivery in deliveries:
+            if self.outbox.get(delivery.fromkey):
+                self.queueOutbound(delivery)
+            else:
+                self.setStatus(delivery)
+                now.append(delivery)
+        if not deliveries:
+            m['status'] = Delivery.ACKED
+        if now:
+            threading.Thread(target=self.deliverGroup, args=(now,), daemon=True).start()
+        return deliveries
+        
+    def deliverGroup(self, deliveries):
+        """
+        Runs in its own thread. One frame, sent to every member at once. 
+        Members that don't ack get retried with backoff like deliver() 
+        does, until out of attempts or time, then go to their outbox.
+        """
+        frame = pigclient.encode('message', deliveries[0].payload)
+        backoff = config.SEND_BACKOFF
+        waiting = deliveries
+        
+        while True:
+            deadline = min(d.deadline for d in waiting)
+            timeout = min(config.SEND_TIMEOUT, deadline - time.monotonic())
+            responses = pigclient.sendMany([d.address for d in waiting], frame, 
+                                           timeout, config.FANOUT_LIMIT)
+            acked, left = [], []
+            for delivery, response in zip(waiting, responses):
+                delivery.attempts += 1
+                if pigclient.acked(response):
+                    delivery.finish(Delivery.ACKED)
+                    acked.append(delivery)
+                else:
+                    left.append(delivery)
+            if acked:
+                self.statusQueue.put(acked)
+            waiting = left
+            
+            if (not waiting or waiting[0].attempts > config.SEND_RETRIES or 
+                    time.monotonic() + backoff >= deadline):
+                break
+            time.sleep(backoff)
+            backoff *= 2
+            
+        for delivery in waiting:
+            delivery.state = Delivery.QUEUED
+        if waiting:
+            self.statusQueue.put(waiting)
+   
+   
    
     def receiveMessage(self, msg):
         fromkey = self.addressToString(msg['from'])
@@ -160,15 +523,55 @@ class Model:
             print('adding contact from non-scan message')
             self.addContact(msg)
             
-        #append message
-        self.messages[fromkey].append(msg)
+        #any traffic from them counts as being alive
+        self.renewLease(fromkey)
+        self.flushOutbox(fromkey)
+        
+        #retries and batches can hand us the same message twice
+        if 'id' in msg and not self.markSeen(msg['id']):
+            DUPLICATES.inc()
+            return
+        MESSAGES_IN.inc()
+        
+        #group messages go in the group's conversation, not the sender's
+        if msg.get('group'):
+            fromkey = self.joinGroup(msg['group'], fromkey)
+        
+        #add message in timestamp order
+        self.insertMessage(fromkey, msg)
+        
+        #unread count only goes up for conversations we're not looking at
+        if fromkey != self.activeKey:
+            self.unread[fromkey] = self.unread.get(fromkey, 0) + 1
         
         #now we have to reorder orderd list, for correct sorting
         self.ordered.remove(fromkey)
         self.ordered.insert(0, fromkey)
+   
+   
+   
+    def insertMessage(self, fromkey, msg):
+        """Insert by timestamp. Usually that's the end, late arrivals get bisected in"""
+        convo = self.messages[fromkey]
+        stamp = msg.get('timestamp', 0)
+        
+        if not convo or convo[-1].get('timestamp', 0) <= stamp:
+            convo.append(msg)
+        else:
+            bisect.insort(convo, msg, key=lambda m: m.get('timestamp', 0))
+            self.changes['reordered'].add(fromkey)
             
-        #set updated flag to be read by GUI
-        self.updated = True
+        self.trimHistory(fromkey)
+        self.recordMessage(fromkey, msg)
+        
+    def markSeen(self, msgid):
+        """Remember id. Returns False if we'd already seen it"""
+        if msgid in self.seen:
+            return False
+        self.seen[msgid] = None
+        if len(self.seen) > config.SEEN_IDS_MAX:
+            self.seen.popitem(last=False)
+        return True
    
    
    
@@ -181,11 +584,34 @@ class Model:
     
     Regular messages don't have either key, so we just receiveMessage(). This 
     will still add contact if new, just in case, but skips any reply logic.
+    
+    Peer exchange: replies also list up to config.PEX_MAX peers the replier 
+    has seen lately ('peers', as fromkeys). We scan just those, so one reply 
+    is enough to find the rest of the network, and discover() only sweeps 
+    the whole subnet every config.SWEEP_EVERY rounds. The rounds in between 
+    scan the peers we know, which keeps leases fresh and brings in their 
+    lists. Peers only get scanned if they're on our own /24, same as a sweep.
     """
    
    
+    def discover(self):
+        """One round of discovery, for the GUI/daemon scan timer"""
+        self.rounds += 1
+        own = self.addressToString(self.ADDRESS)
+        known = [k for k, c in self.contacts.items() 
+                 if k != own and 'members' not in c and not c.get('test')]
+        
+        if (not config.PEER_EXCHANGE or not known or config.SWEEP_EVERY <= 1 
+                or self.rounds % config.SWEEP_EVERY == 1):
+            self.scan()
+        else:
+            for fromkey in known:
+                self.scanAddress(self.contacts[fromkey]['address'])
+   
+   
     def scan(self, rnge=None):
         """Accepts range of hosts to scan as tuple/list. Only works for local /24 networks"""
+        started = time.perf_counter()
         r1=1
         r2=255
         if rnge:
@@ -198,18 +624,21 @@ class Model:
         
         #send scan message to every other host in range
         for host in range(r1, r2):
-            dest = tuple([network+str(host), self.ADDRESS[1]])
-            m = {'to':dest, 
-                 'from':self.ADDRESS, 
-                 'timestamp': time.time(),
-                 'text':self.SCANKEY,
-                 'nickname':self.NICKNAME,
-                }
-            
-            threading.Thread(
-                target=pigclient.sendMessage,
-                args=(dest, m),
-            ).start()
+            self.scanAddress(tuple([network+str(host), self.ADDRESS[1]]))
+        SCAN_MS.observe((time.perf_counter() - started) * 1000)
+        
+    def scanAddress(self, dest):
+        m = {'to':dest, 
+             'from':self.ADDRESS, 
+             'timestamp': time.time(),
+             'text':self.SCANKEY,
+             'nickname':self.NICKNAME,
+            }
+        
+        threading.Thread(
+            target=pigclient.sendMessage,
+            args=(dest, m, config.SEND_TIMEOUT),
+        ).start()
    
     def reply(self, trgt):
     
@@ -222,22 +651,69 @@ class Model:
              'text':self.REPLKEY,
              'nickname':self.NICKNAME,
             }
+        if config.PEER_EXCHANGE:
+            m['peers'] = self.peerDigest(self.addressToString(trgt))
         threading.Thread(
             target=pigclient.sendMessage,
-            args=(trgt, m),
+            args=(trgt, m, config.SEND_TIMEOUT),
         ).start()
    
     def receiveScan(self, msg): 
         fromkey = self.addressToString(msg['from'])
         
-        #add contact if new
+        #add contact if new, otherwise pick up nickname changes
         if fromkey not in self.contacts:
             print('adding contact from scan message')
             self.addContact(msg)
+        elif fromkey != self.addressToString(self.ADDRESS):
+            nickname = msg.get('nickname')
+            if nickname and nickname != self.contacts[fromkey]['nickname']:
+                self.contacts[fromkey]['nickname'] = nickname
+                self.changes['renamed'].add(fromkey)
+        self.renewLease(fromkey)
+        
+        #they're back, send anything we owe them
+        self.flushOutbox(fromkey)
         
         #we're obligated to reply to scans (but NOT replies)
         if msg['text'] == self.SCANKEY:
             self.reply(fromkey)
+        elif config.PEER_EXCHANGE and msg.get('peers'):
+            self.mergePeers(msg['peers'])
+            
+    def peerDigest(self, exclude):
+        """Up to PEX_MAX peers that are online, most recently seen first"""
+        own = self.addressToString(self.ADDRESS)
+        live = [k for k, c in self.contacts.items() 
+                if c.get('online') and 'members' not in c and not c.get('test') 
+                and k != own and k != exclude]
+        live.sort(key=lambda k: self.contacts[k].get('lastSeen', 0), reverse=True)
+        return live[:config.PEX_MAX]
+        
+    def mergePeers(self, peers):
+        """Scan peers from someone's digest that we don't know yet"""
+        now = time.time()
+        own = self.addressToString(self.ADDRESS)
+        network = own.split(';')[0].rsplit('.', 1)[0] + '.'
+        
+        for fromkey in peers[:config.PEX_MAX]:
+            if not isinstance(fromkey, str) or fromkey in self.contacts or fromkey == own:
+                continue
+            if not fromkey.startswith(network):
+                continue    #only our own /24, same as scan()
+            if now - self.probed.get(fromkey, 0) < config.PRESENCE_LEASE:
+                continue    #already asked them recently
+            try:
+                dest = self.stringToAddress(fromkey)
+            except (ValueError, IndexError):
+                continue
+            self.probed[fromkey] = now
+            self.scanAddress(dest)
+        
+        #forget old probes so this doesn't grow forever
+        if len(self.probed) > 1000:
+            self.probed = {k: t for k, t in self.probed.items() 
+                           if now - t < config.PRESENCE_LEASE}
    
    
    
@@ -272,29 +748,50 @@ class Model:
         print('Setting IP to: ', IP)
         return IP
     
-    def fillTestData(self):
-        #for testing
-        a1 = ('127.0.0.5', 49000)
-        ua1 = self.addressToString(a1)
-        a2 = ('127.0.0.6', 49000)
-        ua2 = self.addressToString(a2)
-        
-        self.contacts[ua1] = {'address':a1, 'nickname':'Alice'}
-        self.contacts[ua2] = {'address':a2, 'nickname':'Bob'}
-        self.messages[ua1] = [
-            {'text':"Hello user, my name is alice and I'm reaaaaaaaaaaaaaal bad", 'from':a1},
-            {'text':"oh hello alice how are you doing today my name is user what are you into anyways do you like cars wanna see my car what if we go on a date how about that huh? Want to?", 'from':self.ADDRESS},
-            ]
-       
-        self.messages[ua2] = [
-            {'text':"Hello user, my name is bob", 'from':a2},
-            {'text':"oh hello bob", 'from':self.ADDRESS},
-            ]
-
-        self.contacts['hi'] = {'address':a2, 'nickname':'Eve'}
-        self.contacts['ok'] = {'address':a2, 'nickname':'Mal'}
-        self.contacts['why'] = {'address':a2, 'nickname':'Aaron'}
-        self.contacts['me'] = {'address':a2, 'nickname':'Sue'}
+    TESTWORDS = ('hey', 'ok', 'lol', 'yeah', 'no', 'the', 'a', 'to', 'you', 'i', 'it', 'and', 
+                 'what', 'is', 'that', 'pig', 'mud', 'tonight', 'later', 'sounds', 'good', 
+                 'going', 'were', 'did', 'see', 'this', 'truffles', 'haha', 'maybe', 'sure',
+                 'tomorrow', 'wait', 'really?', 'think', 'about', 'farm', 'oink', 'dinner')
+    
+    def fillTestData(self, contacts=6, perContact=40, seed=None):
+        """
+        Made up contacts and conversations, for trying out the GUI and for 
+        bench/render.py. Message lengths are skewed like real chat: mostly a 
+        few words, now and then a paragraph, and the odd long unbroken link. 
+        Nobody answers at these addresses, so test contacts are left out of 
+        presence, scanning and peer lists.
+        """
+        rng = random.Random(seed)
+        now = time.time()
+        
+        for c in range(contacts):
+            address = ('127.1.%d.%d' % (c // 254, c % 254 + 1), self.ADDRESS[1])
+            fromkey = self.addressToString(address)
+            self.contacts[fromkey] = {'address':address, 'nickname':'test%d' % c, 
+                                      'online':True, 'lastSeen':now, 'test':True}
+            
+            msgs = self.messages[fromkey] = []
+            t = now - perContact * 60
+            for m in range(perContact):
+                t += rng.expovariate(1 / 60)
+                words = max(1, int(rng.lognormvariate(1.8, 0.9)))
+                text = ' '.join(rng.choice(self.TESTWORDS) for _ in range(words))
+                if rng.random() < 0.02:
+                    text += ' https://example.com/' + 'x' * rng.randint(20, 80)
+                    
+                msg = {'id':uuid.uuid4().hex, 'timestamp':t, 'text':text}
+                if rng.random() < 0.5:
+                    msg.update({'from':self.ADDRESS, 'to':address, 'status':'acked'})
+                else:
+                    msg.update({'from':address, 'to':self.ADDRESS, 'nickname':'test%d' % c})
+                msgs.append(msg)
+                
+            #random gaps can run past now. Slide it all back, or real messages 
+            #would sort into the middle of the conversation
+            if t > now:
+                for msg in msgs:
+                    msg['timestamp'] -= t - now
+            self.ordered.insert(0, fromkey)
 
     def setOwnNickname(self):
         """If nickname configured, use it. Else choose random"""
@@ -321,11 +818,122 @@ class Model:
         
         #set up
         print('adding contact: ', fromkey)
-        self.contacts[fromkey] = {'address': address, 'nickname':nickname}
+        self.contacts[fromkey] = {'address': address, 'nickname':nickname, 
+                                  'online':True, 'lastSeen':time.time()}
         self.messages[fromkey] = []
         self.ordered.insert(0, fromkey)
         
-        self.updated = True
+        self.changes['added'].add(fromkey)
+        
+        
+    #----------Change tracking ------------#
+    """Instead of one 'something changed' flag, we record exactly what 
+    changed since the GUI last looked: new messages per conversation, 
+    contacts added/renamed/removed. GUI calls popChanges() to drain it, 
+    and only redraws the parts that were touched.
+    """
+    
+    def resetChanges(self):
+        self.changes = {'messages':{},     #fromkey -> list of new msgs
+                        'added':set(),     #new contacts
+                        'renamed':set(),   #nickname changed
+                        'removed':set(),   #contacts gone (eg address change, evicted)
+                        'presence':set(),  #went online/offline
+                        'status':set(),    #our sent messages got acked/failed
+                        'reordered':set(),   #message landed before the end of a convo
+                        'trimmed':set(),   #convo dropped old messages (MAX_HISTORY)
+                       }
+    
+    def popChanges(self):
+        """Return everything that changed since last call, and start fresh"""
+        changes = self.changes
+        self.resetChanges()
+        return changes
+    
+    def recordMessage(self, fromkey, msg):
+        self.changes['messages'].setdefault(fromkey, []).append(msg)
+    
+    def markRead(self, fromkey):
+        """GUI calls this when opening a conversation"""
+        self.activeKey = fromkey
+        self.unread.pop(fromkey, None)
+        
+    def unreadCount(self, fromkey):
+        return self.unread.get(fromkey, 0)
+        
+        
+    #----------Presence and memory limits ------------#
+    """Every scan, reply or message from a peer renews its lease. If the 
+    lease runs out (config.PRESENCE_LEASE) the peer is marked offline, and 
+    if it stays gone for config.EVICT_AFTER we drop it completely. Self and 
+    the conversation currently open are never evicted. When we scan less 
+    often than the lease (idle GUI), the caller passes a longer lease so 
+    peers don't flicker offline between rounds.
+    
+    Conversations are capped at config.MAX_HISTORY messages. Older ones 
+    are dropped, or appended to a file in config.HISTORY_DIR if it's set.
+    """
+    
+    def renewLease(self, fromkey):
+        contact = self.contacts[fromkey]
+        contact['lastSeen'] = time.time()
+        if not contact.get('online'):
+            contact['online'] = True
+            self.changes['presence'].add(fromkey)
+    
+    def checkPresence(self, lease=None):
+        """Mark stale contacts offline, evict ones gone too long"""
+        now = time.time()
+        lease = max(config.PRESENCE_LEASE, lease or 0)
+        own = self.addressToString(self.ADDRESS)
+        
+        for fromkey in list(self.contacts):
+            if fromkey == own or fromkey == self.activeKey:
+                continue
+            if self.outbox.get(fromkey):
+                continue    #still holding messages for them, keep
+            contact = self.contacts[fromkey]
+            if 'members' in contact or contact.get('test'):
+                continue    #groups and made up contacts don't come and go
+            age = now - contact.get('lastSeen', now)
+            
+            if age > lease + config.EVICT_AFTER:
+                self.evictContact(fromkey)
+            elif age > lease and contact.get('online'):
+                contact['online'] = False
+                self.changes['presence'].add(fromkey)
+    
+    def evictContact(self, fromkey):
+        print('evicting contact: ', fromkey)
+        self.spillHistory(fromkey, self.messages.pop(fromkey, []))
+        self.contacts.pop(fromkey)
+        self.unread.pop(fromkey, None)
+        try:
+            self.ordered.remove(fromkey)
+        except ValueError:
+            pass
+        self.changes['removed'].add(fromkey)
+        
+    def trimHistory(self, fromkey):
+        convo = self.messages[fromkey]
+        excess = len(convo) - config.MAX_HISTORY
+        if excess > 0:
+            self.spillHistory(fromkey, convo[:excess])
+            del convo[:excess]
+            self.changes['trimmed'].add(fromkey)
+    
+    def spillHistory(self, fromkey, msgs):
+        """Append dropped messages to HISTORY_DIR as json lines, if configured"""
+        if not config.HISTORY_DIR or not msgs:
+            return
+        try:
+            os.makedirs(config.HISTORY_DIR, exist_ok=True)
+            path = os.path.join(config.HISTORY_DIR, fromkey.replace(';', '_') + '.jsonl')
+            with open(path, 'a', encoding='utf-8') as f:
+                for msg in msgs:
+                    f.write(json.dumps(msg, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print('could not spill history for', fromkey, e)
         
         
 
@@ -3,46 +3,86 @@
 import model
 import config
 import scrollCanvas
+import textLayout
+import cadence
+import metrics
+import profiling
 
 import tkinter
 from tkinter import ttk 
 from functools import partial
 import os
+import time
+
+
+REDRAW_MS = metrics.histogram('gui.redraw_ms')
+CONVO_MS = metrics.histogram('gui.convo_render_ms')
+CONTACTS_MS = metrics.histogram('gui.contacts_update_ms')
 
 
 class Gui:
     
+    #what we show under our own messages for each Delivery state
+    STATUSTEXT = {'pending':'sending...', 'queued':'waiting for them', 
+                  'acked':'delivered', 'failed':'not delivered'}
+    
+    #image files, loaded the first time they're used (see getImage)
+    IMAGEFILES = {'me':{'lid':'lid_me.png', 'base':'base_me.png'},
+                  'th':{'lid':'lid_them.png', 'base':'base_them.png'},
+                  'btn':{'sttg':'hamburger.png'},
+                 }
+    
     #-------------Setup functions-----------#
+    """Startup is split so a window shows up right away. __init__ only builds 
+    the empty window. run() draws it, then startup() (from inside the Tk loop) 
+    does the slow parts: model/server, views, and scanning after that. Each 
+    phase's time goes in self.timings, and gets printed once we're up.
+    """
+    
+    def __init__(self, model=None):
     
-    def __init__(self):
+        self.timings = {}
+        self.started = t = time.perf_counter()
     
         self.root = tkinter.Tk()
         self.root.title("Oink")
         
         #Define data and references\
-        self.POLLFREQUENCY = 1000   #in ms--1000 = 1 second
-        self.SCANFREQUENCY = 5000
+        self.pollCadence = cadence.Cadence(config.POLL_MIN, config.POLL_MAX, config.CADENCE_BACKOFF)
+        self.scanCadence = cadence.Cadence(config.SCAN_MIN, config.SCAN_MAX, config.CADENCE_BACKOFF)
+        self.pollJob = None         #after() ids, so we can reschedule sooner on activity
+        self.scanJob = None
+        self.lastScan = None     #monotonic time scanLoop last ran
+        self.profileJob = None
         self.DIRPATH = os.path.dirname(__file__)
-        self.model = model.Model()  #reference to mid layer
-        self.fromkey = self.model.addressToString(self.model.ADDRESS) #current convo we looking at
+        self.model = model          #reference to mid layer, made in startup() if not given
+        self.fromkey = None         #current convo we looking at
         self.contactScroll = None 
         self.convoScroll = None
         self.darkmode = config.DARKMODE
+        self.layout = textLayout.TextLayout(self.root, config.LAYOUT_CACHE_SIZE)
             
         #GUI initialization steps
         self.images = {'me':{}, 'th':{}, 'btn':{}}
-        self.loadImages()
         (self.setLightColors, self.setDarkColors)[self.darkmode]() #ternary from stackoverflow
         self.initStyles()
         
         #On scroll event, check X coordinate and scroll appropriate GUI section.
         #https://stackoverflow.com/questions/17355902/tkinter-binding-mousewheel-to-scrollbar
         def _on_mousewheel(event):
+            if self.convoScroll is None:
+                return
             if self.root.winfo_pointerx()-self.root.winfo_rootx() < 330:
                 self.contactScroll.yview_scroll(int(-1*(event.delta/120)), "units")
             else:
                 self.convoScroll.yview_scroll(int(-1*(event.delta/120)), "units")
         self.root.bind_all("<MouseWheel>", _on_mousewheel)
+        
+        #user doing anything speeds timers back up, losing focus slows them down
+        self.root.bind_all("<Key>", self.speedUp, add='+')
+        self.root.bind_all("<Button>", self.speedUp, add='+')
+        self.root.bind("<FocusIn>", self.speedUp, add='+')
+        self.root.bind("<FocusOut>", self.onFocusOut, add='+')
                
         #create skel frames to hold contacts, conversations
         self.contactSkel = ttk.Frame(self.root, width=330, height=600, style="G.TFrame")
@@ -51,26 +91,60 @@ class Gui:
         
         self.convoSkel = ttk.Frame(self.root, style="B.TFrame")
         self.convoSkel.pack(side='left', fill='both', expand=True)
-
+        
+        self.timed('window', t)
+        
+        
+    def run(self):
+        """Draw the (empty) window first, then do the slow setup from inside the loop"""
+        t = time.perf_counter()
+        self.root.update()
+        self.timed('firstframe', t)
+        
+        self.root.after_idle(self.startup)
+        self.root.mainloop()
+        
+        
+    def startup(self):
+        t = time.perf_counter()
+        if self.model is None:
+            self.model = model.Model()
+        self.fromkey = self.model.addressToString(self.model.ADDRESS)
+        t = self.timed('model', t)
+        
         #setup view, start loop
-        self.poll()
-        self.scanLoop()
         self.ContactsView() 
         self.ConvoView()
-        self.root.mainloop()
-
-
-    def loadImages(self):
+        t = self.timed('views', t)
+        
+        self.startWakeup()
+        metrics.start()
+        
+        #Ctrl+Shift+P toggles profiling, see profiling.py
+        profiling.watchTk()
+        profiling.start()
+        self.profileLoop()
+        self.root.bind_all("<Control-P>", self.toggleProfiling)
+        
+        #first scan waits until the views are actually on screen
+        self.scanJob = self.root.after_idle(self.scanLoop)
         
-        def getImg(filename):
-            """Helper function"""
-            return tkinter.PhotoImage(file=os.path.join(self.DIRPATH, 'images', filename))
         
-        self.images['me']['lid'] = getImg('lid_me.png')
-        self.images['me']['base'] = getImg('base_me.png')
-        self.images['th']['lid'] = getImg('lid_them.png')
-        self.images['th']['base'] = getImg('base_them.png')
-        self.images['btn']['sttg'] = getImg('hamburger.png')
+    def timed(self, phase, start):
+        """Record how long a startup phase took, returns now so next phase can start"""
+        now = time.perf_counter()
+        self.timings[phase] = now - start
+        return now
+
+
+    def getImage(self, group, name):
+        """Images get loaded the first time they're asked for"""
+        try:
+            return self.images[group][name]
+        except KeyError:
+            path = os.path.join(self.DIRPATH, 'images', self.IMAGEFILES[group][name])
+            image = self.images[group][name] = tkinter.PhotoImage(file=path)
+            return image
 
 
     def setDarkColors(self):        
@@ -107,13 +181,11 @@ class Gui:
      
     def initStyles(self):
     
-        try:
-            self.style.destroy()
-        except AttributeError:
-            pass
-    
-        self.style = ttk.Style()
-        self.style.theme_use('clam')
+        #style is only created once. After that configure() updates it in place,
+        #and every ttk widget using it picks up the change by itself
+        if not hasattr(self, 'style'):
+            self.style = ttk.Style()
+            self.style.theme_use('clam')
         
         #frames 
         if True:
@@ -211,6 +283,28 @@ class Gui:
             self.style.map('BFooter.TButton', background=[('active', self.gr)])
       
       
+    def applyTheme(self):
+        """
+        Recolor what's already on screen instead of rebuilding it. ttk widgets 
+        follow their styles, plain tk widgets get their colors set directly, 
+        and canvas items are recolored by tag (pooled hidden ones included).
+        """
+        self.initStyles()
+        
+        #contacts side
+        self.contactScroll['bg'] = self.gr
+        self.contactList['bg'] = self.gr
+        for row in self.contactRows.values():
+            row['frame']['bg'] = self.bl if row['highlighted'] else self.gr
+            
+        #convo side
+        self.convoScroll['bg'] = self.bl
+        self.convoEntry.configure(bg=self.gr, fg=self.tx)
+        self.convoScroll.itemconfigure('rect&&me', fill=self.meColor)
+        self.convoScroll.itemconfigure('rect&&th', fill=self.thColor)
+        self.convoScroll.itemconfigure('txt', fill=self.cv)
+      
+      
     #-------------Views--------------------#
   
 
@@ -233,7 +327,7 @@ class Gui:
             HF.pack(side='top', fill='x')
             
             #settings
-            settings = ttk.Button(HF, image=self.images['btn']['sttg'], style="G.TButton", width=6) 
+            settings = ttk.Button(HF, image=self.getImage('btn', 'sttg'), style="G.TButton", width=6) 
             settings.configure(command=self.SettingView)
             settings.pack(side='left')
             
@@ -245,67 +339,160 @@ class Gui:
         if True:
             #create scrolling canvas, create frame inside canvas
             self.contactScroll = scrollCanvas.ScrollCanvas(self.contactsFrame, highlightthickness=0, bg=self.gr) 
-            frame = tkinter.Frame(self.contactScroll, bg=self.gr)
-
-            #callback used by widgets
-            def callback(event, fk=None):
-                self.fromkey = fk 
-                self.ConvoView()
-                self.ContactsView()
-
-            #create scrollable group of widgets, inside frame (inside canvas)
-            for fromkey in self.model.ordered:
-                #get data
-                nickname = '\n' + self.model.contacts[fromkey]['nickname']
-                try:
-                    last = self.model.messages[fromkey][-1]['text']
-                except KeyError:
-                    last = 'No messages yet :( \n(key)'
-                except IndexError:
-                    last = "no messages yet :( \n(index)"
-                    
-                #format text nicely
-                frmtText, rows = self.formatMessage(last[:70], lineLength=35)
-                if rows == 2:
-                    frmtText = frmtText[:frmtText.rfind('\n')] + '...'
-                elif rows == 0:
-                    frmtText = frmtText + '\n '
-                   
-                #message frame   
-                msgFrame = tkinter.Frame(frame, width=300, height=60, bg=self.gr)
-                msgFrame.pack_propagate(False)
-                msgFrame.pack(fill='x', ipady=15, ipadx=15)
-                
-                #bolded name label
-                name = ttk.Label(msgFrame, style="C2.TLabel", text=nickname)
-                name.bind("<Button-1>", partial(callback, fk=fromkey))
-                name.pack(side="top", fill='x', padx=15)
-                
-                #unbolded message text
-                text = ttk.Label(msgFrame, style="C1.TLabel", text=frmtText)
-                text.bind("<Button-1>", partial(callback, fk=fromkey))
-                text.pack(side="top", fill='x', expand=True, padx=15)
-                
-                #separator
-                ttk.Separator(frame, style="C.TSeparator").pack(fill='x', padx=15)
-                
-                #check if this is current convo--if yes, highlight
-                if fromkey == self.fromkey:
-                    msgFrame['bg'] = self.bl 
-                    name['style'] = "Chighlight2.TLabel"
-                    text['style'] = "Chighlight1.TLabel"
+            self.contactList = tkinter.Frame(self.contactScroll, bg=self.gr)
+            
+            #rows are cached by fromkey and reused, see updateContacts()
+            self.contactRows = {}
+            self.contactOrder = []
+            self.updateContacts()
                 
             #pack the frame, and create view window within the canvas to show frame
-            frame.pack(fill='both')
-            self.contactScroll.create_window(0, 0, anchor='nw', window=frame)
+            self.contactList.pack(fill='both')
+            self.contactScroll.create_window(0, 0, anchor='nw', window=self.contactList)
             self.contactScroll.finish()
+            
+            #rows get added/removed later, keep scrollregion in step with the frame
+            self.contactList.bind("<Configure>", lambda event: self.contactScroll.refresh())
+
+
+    def updateContacts(self, keys=None):
+        """
+        Bring contact rows in line with the model. Rows are created once per 
+        contact and then reused: we only rewrite text for contacts in keys 
+        (None means all), fix up the highlight, and move rows whose place in 
+        the recency order changed.
+        """
+        started = time.perf_counter()
+        #drop rows for contacts that are gone
+        for fromkey in list(self.contactRows):
+            if fromkey not in self.model.contacts:
+                row = self.contactRows.pop(fromkey)
+                row['frame'].destroy()
+                row['sep'].destroy()
+        
+        for fromkey in self.model.ordered:
+            row = self.contactRows.get(fromkey)
+            if row is None:
+                row = self.contactRows[fromkey] = self.contactRow(fromkey)
+            elif keys is not None and fromkey not in keys:
+                self.highlightRow(fromkey, row)
+                continue
+                
+            nickname, frmtText = self.contactPreview(fromkey)
+            if row['nickname'] != nickname:
+                row['name']['text'] = row['nickname'] = nickname
+            if row['preview'] != frmtText:
+                row['text']['text'] = row['preview'] = frmtText
+            self.highlightRow(fromkey, row)
+            
+        #fix up recency order. Usually one contact jumped to the top, so only 
+        #repack rows that are out of place, in front of whatever's there now
+        if self.contactOrder != self.model.ordered:
+            packed = [k for k in self.contactOrder if k in self.contactRows]
+            for i, fromkey in enumerate(self.model.ordered):
+                if i < len(packed) and packed[i] == fromkey:
+                    continue
+                if fromkey in packed:
+                    packed.remove(fromkey)
+                row = self.contactRows[fromkey]
+                if i < len(packed):
+                    row['frame'].pack(fill='x', ipady=15, ipadx=15, 
+                                      before=self.contactRows[packed[i]]['frame'])
+                else:
+                    row['frame'].pack(fill='x', ipady=15, ipadx=15)
+                row['sep'].pack(fill='x', padx=15, after=row['frame'])
+                packed.insert(i, fromkey)
+            self.contactOrder = list(self.model.ordered)
+        CONTACTS_MS.observe((time.perf_counter() - started) * 1000)
+
+
+    def contactRow(self, fromkey):
+        """Build widgets for one contact. Text gets filled in by updateContacts()"""
+        
+        #callback used by widgets
+        def callback(event, fk=None):
+            old = self.fromkey
+            self.fromkey = fk 
+            self.model.markRead(fk)
+            self.ConvoView()
+            self.updateContacts({old, fk})
+            
+        #message frame   
+        msgFrame = tkinter.Frame(self.contactList, width=300, height=60, bg=self.gr)
+        msgFrame.pack_propagate(False)
+        
+        #bolded name label
+        name = ttk.Label(msgFrame, style="C2.TLabel")
+        name.bind("<Button-1>", partial(callback, fk=fromkey))
+        name.pack(side="top", fill='x', padx=15)
+        
+        #unbolded message text
+        text = ttk.Label(msgFrame, style="C1.TLabel")
+        text.bind("<Button-1>", partial(callback, fk=fromkey))
+        text.pack(side="top", fill='x', expand=True, padx=15)
+        
+        #separator
+        sep = ttk.Separator(self.contactList, style="C.TSeparator")
+        
+        #last text/highlight we set, so we can skip no-op updates
+        return {'frame':msgFrame, 'name':name, 'text':text, 'sep':sep, 
+                'nickname':None, 'preview':None, 'highlighted':False}
+        
+        
+    def highlightRow(self, fromkey, row):
+        """check if this is current convo--if yes, highlight"""
+        highlight = fromkey == self.fromkey
+        if highlight == row['highlighted']:
+            return
+        row['highlighted'] = highlight
+        if highlight:
+            row['frame']['bg'] = self.bl 
+            row['name']['style'] = "Chighlight2.TLabel"
+            row['text']['style'] = "Chighlight1.TLabel"
+        else:
+            row['frame']['bg'] = self.gr 
+            row['name']['style'] = "C2.TLabel"
+            row['text']['style'] = "C1.TLabel"
+            
+            
+    def contactPreview(self, fromkey):
+        """Returns (title, preview text) for a contact row"""
+        nickname = '\n' + self.model.contacts[fromkey]['nickname']
+        unread = self.model.unreadCount(fromkey)
+        if unread:
+            nickname += '  (' + str(unread) + ')'
+        if not self.model.contacts[fromkey].get('online', True):
+            nickname += '  - offline'
+        try:
+            last = self.model.messages[fromkey][-1]['text']
+        except KeyError:
+            last = 'No messages yet :( \n(key)'
+        except IndexError:
+            last = "no messages yet :( \n(index)"
+            
+        #format text nicely, two lines max
+        frmtText, rows, _ = self.formatMessage(last[:70], width=240, font=('arial', 13))
+        if rows >= 2:
+            frmtText = '\n'.join(frmtText.split('\n')[:2]) + '...'
+        elif rows == 0:
+            frmtText = frmtText + '\n '
+        return nickname, frmtText
 
 
     def ConvoView(self):
+        with CONVO_MS.time():
+            self.buildConvoView()
+            
+            
+    def buildConvoView(self):
 
         #setup
         if True:
+            #redrawing the same conversation (reordered/trimmed) keeps what's typed
+            draft = ''
             try:
+                if self.convoKey == self.fromkey:
+                    draft = self.convoEntry.get("1.0", "end-1c")
                 self.convoFrame.destroy()
             except AttributeError:
                 pass
@@ -313,7 +500,7 @@ class Gui:
             self.convoFrame = tkinter.Frame(self.convoSkel) 
             self.convoFrame.pack(fill='both', expand=True)
              
-            fromkey = self.fromkey
+            fromkey = self.convoKey = self.fromkey
             
         
         #convo header
@@ -322,8 +509,9 @@ class Gui:
             HF.pack(side='top', fill='x')
             
             #conversation title (eg nickname)
-            ttk.Label(HF, text=self.model.contacts[fromkey]['nickname'], 
-                      style="B.TLabel").pack(side='top')
+            self.convoTitle = ttk.Label(HF, text=self.model.contacts[fromkey]['nickname'], 
+                                        style="B.TLabel")
+            self.convoTitle.pack(side='top')
 
               
         #footer
@@ -338,21 +526,19 @@ class Gui:
                 text = entry.get("1.0", "end-1c")
                 entry.delete("1.0", "end-1c")
                 
-                #send
+                #send, then update screen
                 self.model.sendMessage(fromkey, text)
-                
-                #update screen 
-                self.ContactsView()
-                self.ConvoView()
+                self.applyChanges()
                 
             #send button
             ttk.Button(footerFrame, text="Send", style="BFooter.TButton",
                 command=setupSend).pack(side='right', fill='y')
             
             #text entry field
-            entry = tkinter.Text(footerFrame, relief='flat',
+            entry = self.convoEntry = tkinter.Text(footerFrame, relief='flat',
                 font=('arial', 12), bg=self.gr, fg=self.tx)
             entry.bind('<Return>', setupSend)
+            entry.insert("1.0", draft)
             entry.pack(side='right', padx=20, pady=10)
             entry.focus_set()
         
@@ -360,15 +546,47 @@ class Gui:
         #scroll area (pig texts)
         if True:
             #create our scrolling canvas object
-            self.convoScroll = scrollCanvas.PigCanvas(self.convoFrame, bg=self.bl, highlightthickness=0)
+            self.convoScroll = scrollCanvas.PigCanvas(self.convoFrame, drawRow=self.drawBubble,
+                                                      windowed=config.WINDOWED_CONVO,
+                                                      bg=self.bl, highlightthickness=0)
 
-            #draw each message w handy appendMessage()
+            #lay out each message w handy appendMessage(), visible ones get drawn
             for msg in self.model.messages[fromkey]:
                 self.appendMessage(self.convoScroll, msg)
             
             #finish setting up scroll canvas, move view to bottom
             self.convoScroll.finish()
-            self.convoScroll.yview_moveto(self.convoScroll.current_Y)
+            self.convoScroll.yview_moveto(1.0)
+            
+            
+    def updateConvo(self, newMsgs):
+        """Add bubbles for just the new messages, leave the rest of the canvas alone"""
+        pigCanvas = self.convoScroll
+        
+        #only follow new messages down if we were already at the bottom
+        atBottom = pigCanvas.yview()[1] >= 0.999
+        
+        for msg in newMsgs:
+            if id(msg) not in pigCanvas.shown:
+                self.appendMessage(pigCanvas, msg)
+        
+        pigCanvas.refresh()
+        if atBottom:
+            pigCanvas.yview_moveto(1.0)
+        pigCanvas.render(*pigCanvas.yview())
+            
+            
+    def updateStatus(self):
+        """Rewrite delivery status text of our messages that are still in flight"""
+        pigCanvas = self.convoScroll
+        
+        for msgid, item in list(pigCanvas.statusItems.items()):
+            msg, shown = item
+            if msg['status'] != shown:
+                pigCanvas.itemconfigure('st' + msgid, text=self.STATUSTEXT[msg['status']])
+                item[1] = msg['status']
+            if msg['status'] in ('acked', 'failed'):
+                del pigCanvas.statusItems[msgid]
  
  
     def SettingView(self):
@@ -390,9 +608,7 @@ class Gui:
                 self.darkmode = True
                 print('activating dark mode')
             self.settingWin.destroy()
-            self.initStyles()
-            self.ContactsView() 
-            self.ConvoView()
+            self.applyTheme()
                 
         ttk.Label(frame1, text="Dark Mode", style="C1.TLabel").pack(side='left')
         ttk.Button(frame1, text="click me", style="G.TButton", command=setDark).pack(side='right', padx=20)
@@ -421,66 +637,198 @@ class Gui:
     #-------------Helper functions-----------#
     
     
+    def startWakeup(self):
+        """
+        Model pokes us through a pipe whenever something lands in its queues, 
+        and Tk watches the read end, so new messages show up right away and 
+        we don't wake up at all when nothing happens. Where Tk can't watch 
+        files (Windows) we fall back to poll().
+        """
+        try:
+            self.wakeRead, self.wakeWrite = os.pipe()
+            os.set_blocking(self.wakeRead, False)
+            os.set_blocking(self.wakeWrite, False)
+            #file handlers skip tkinter.CallWrapper, so watchTk() can't see this one
+            self.root.tk.createfilehandler(self.wakeRead, tkinter.READABLE, 
+                                           profiling.timedCall(self.onWake))
+        except (AttributeError, OSError, RuntimeError, tkinter.TclError):
+            print('cant watch wakeup pipe, polling instead')
+            self.poll()
+            return
+            
+        self.model.setWakeup(self.wake)
+        self.onWake()   #catch anything that came in before we were listening
+        
+        
+    def wake(self):
+        """Called from server/sender threads. Just writes a byte to the pipe"""
+        try:
+            os.write(self.wakeWrite, b'!')
+        except BlockingIOError:
+            pass    #pipe full, a wakeup is already pending
+            
+            
+    @profiling.span('gui.onWake')
+    def onWake(self, fd=None, mask=None):
+        """Tk calls this when the pipe is readable. One drain covers any number of wakes"""
+        try:
+            os.read(self.wakeRead, 4096)
+        except BlockingIOError:
+            pass
+        self.model.checkInQueue()
+        self.applyChanges()
+        
+        
+    @profiling.span('gui.poll')
     def poll(self):
         """runs in loop, asks model obj to check queue, updates GUI if necessary"""
         self.model.checkInQueue()
+        self.applyChanges()
+        self.pollJob = self.root.after(self.pollCadence.next(), self.poll)
+
+
+    def applyChanges(self):
+        """Redraw only what the model says changed since last time"""
+        changes = self.model.popChanges()
+        started = time.perf_counter()
         
-        #we're lazy, just reload everything to render update. This could be way better.
-        if self.model.updated:
+        #open conversation gets a full redraw only if it's gone or out of order,
+        #otherwise we just add new bubbles / touch up what changed
+        if self.fromkey in changes['removed']:
+            self.fromkey = self.model.activeKey
             self.ConvoView()
-            self.ContactsView()
-            self.model.updated = False
+        elif self.fromkey in changes['reordered']:
+            self.ConvoView()
+        elif (self.fromkey in changes['trimmed'] and 
+                len(self.convoScroll.rows) >= 2 * config.MAX_HISTORY):
+            #canvas still holds messages the model has dropped. Rebuilding every 
+            #trim would be a full redraw per message, so let it get to twice 
+            #the cap first, then start over from what the model kept
+            self.ConvoView()
+        else:
+            if self.fromkey in changes['messages']:
+                self.updateConvo(changes['messages'][self.fromkey])
+            if self.fromkey in changes['status']:
+                self.updateStatus()
+            if self.fromkey in changes['renamed']:
+                self.convoTitle['text'] = self.model.contacts[self.fromkey]['nickname']
+            
+        #messages coming in or new peers showing up count as activity
+        if changes['messages'] or changes['added']:
+            self.speedUp()
             
-        self.root.after(self.POLLFREQUENCY, self.poll)
+        #everything but delivery status shows up in the contacts list
+        touched = (set(changes['messages']) | changes['added'] | changes['renamed'] 
+                   | changes['presence'])
+        if touched or changes['removed']:
+            self.updateContacts(touched)
+            
+        if touched or changes['removed'] or changes['status'] or changes['reordered']:
+            REDRAW_MS.observe((time.perf_counter() - started) * 1000)
 
 
     def scanLoop(self):
         """asks model to scan for other oink clients (by blasting packets)"""
-        self.model.scan()
-        self.root.after(self.SCANFREQUENCY, self.scanLoop)
-
-
-    def formatMessage(self, text, lineLength=35):
-        chopped = text.split(' ')
-        formatted = ''
-        templine = ''
-        rowcount = 0
-        
-        for word in chopped:
-            if len(word) > lineLength:
-                #dump previous line
-                if templine != '':
-                    formatted += templine + '\n'
-                    templine = ''
-                
-                #get length of long word, break it up over lines
-                r = len(word) // lineLength
-                for i in range(r):
-                    formatted += word[i*lineLength:(i+1)*lineLength] + '\n'
-                    rowcount += 1
-                    
-                #add remainder to templine and carry on
-                templine += word[r*lineLength:]
-                
-            elif (len(word) + len(templine)) > lineLength:
-                formatted = formatted + templine + '\n'
-                rowcount += 1
-                templine = word + ' '
-                
-            else:
-                templine = templine + word + ' '
-                
-        formatted += templine 
+        t = time.perf_counter()
+        #replies to the last round can be as old as the wait since it, which 
+        #is up to SCAN_MAX when idle. Give leases twice that
+        now = time.monotonic()
+        since = now - self.lastScan if self.lastScan is not None else 0
+        self.lastScan = now
+        self.model.checkPresence(lease=2 * since)
+        self.model.discover()
+        self.applyChanges()     #presence changes don't come with a wakeup
+        
+        #first time through, this finishes startup
+        if 'scan' not in self.timings:
+            self.timed('scan', t)
+            self.timings['total'] = time.perf_counter() - self.started
+            print('startup timings:', ', '.join(
+                f'{phase} {secs*1000:.0f}ms' for phase, secs in self.timings.items()))
+        self.scanJob = self.root.after(self.scanCadence.next(), self.scanLoop)
+        
         
-        return formatted, rowcount
+    def toggleProfiling(self, event=None):
+        """Spans and slow log on/off. Turning on also takes a cProfile window"""
+        profiling.enable(not profiling.enabled)
+        if profiling.enabled:
+            profiling.startWindow(config.PROFILE_WINDOW or 10)
+            self.profileLoop()
+            
+            
+    def profileLoop(self):
+        """cProfile windows run on the Tk thread, so they're ended (and sampled) from here"""
+        if self.profileJob:
+            self.root.after_cancel(self.profileJob)
+            self.profileJob = None
+        wait = profiling.tick()
+        if wait is not None:
+            self.profileJob = self.root.after(int(wait * 1000) + 1, self.profileLoop)
+            
+            
+    def speedUp(self, event=None):
+        """Something's happening. Put timers back at their floor, sooner if need be"""
+        wait = self.pollCadence.activity()
+        if wait is not None and self.pollJob:
+            self.root.after_cancel(self.pollJob)
+            self.pollJob = self.root.after(wait, self.poll)
+        wait = self.scanCadence.activity()
+        if wait is not None and self.scanJob:
+            self.root.after_cancel(self.scanJob)
+            self.scanJob = self.root.after(wait, self.scanLoop)
+            
+            
+    def onFocusOut(self, event=None):
+        """Focus moving between our own widgets fires this too, so check after it settles"""
+        def check():
+            try:
+                focused = self.root.focus_get()
+            except KeyError:
+                focused = True   #tkinter can't name some widgets, but something has focus
+            if focused is None:
+                self.pollCadence.idle()
+                self.scanCadence.idle()
+        self.root.after_idle(check)
+
+
+    def formatMessage(self, text, width=245, font=('arial', 12)):
+        """Wrap text to width pixels. Returns (wrapped, extra rows, line height). Cached"""
+        return self.layout.wrap(text, width, font)
                 
     
+    @profiling.span('gui.appendMessage')
     def appendMessage(self, pigCanvas, msg):
         """We're manually calculating pixel where new message should be placed"""
+    
+        #set S (sender) key for use in swtch, self.images{}
+        if msg['from'] == self.model.ADDRESS:
+            S = 'me'
+        else:
+            S = 'th'
+          
+        #format message
+        formatted, rows, linespace = self.formatMessage(msg['text'])
+        yspan = rows*linespace
+        
+        #just lay it out, canvas draws it with drawBubble() once it's in view
+        pigCanvas.addRow(msg, S, formatted, yspan)
         
-        #get far end of window, adjust to canvas (which is offset to right by 330 px
+        #watch delivery status until it settles
+        if 'status' in msg and msg['status'] not in ('acked', 'failed'):
+            pigCanvas.statusItems[msg['id']] = [msg, msg['status']]
+            
+            
+    def drawBubble(self, pigCanvas, row, group=None):
+        """
+        Put one laid out message (see PigCanvas.addRow) on the canvas. If 
+        we're handed a recycled group of items we move and retext those, 
+        otherwise we create them.
+        """
+        msg, y, yspan, formatted, S = row
+        
+        #get far end of canvas (cached by PigCanvas, no geometry query)
         #create swtch dict to configure canvas items
-        w = self.root.winfo_width() - 330  
+        w = pigCanvas.width
         swtch = {'me':{'x1':w-300, 
                        'x2':w-5, 
                        'xm':w-275, 
@@ -492,54 +840,79 @@ class Gui:
                        'clr':self.thColor,
                        'tag':'th',}
                 }
-    
-        #set S (sender) key for use in swtch, self.images{}
-        if msg['from'] == self.model.ADDRESS:
-            S = 'me'
-        else:
-            S = 'th'
-          
-        #format message
-        formatted, rows = self.formatMessage(msg['text'])
-        yspan = rows*18
-
+        sw = swtch[S]
+        
+        #delivery status for our own messages, tagged so updateStatus() can find it
+        status = self.STATUSTEXT.get(msg.get('status'), '')
+        sttag = 'st' + msg['id'] if status else None
+        
+        if group is not None:
+            rect, lid, base, text, st = group['ids']
+            pigCanvas.coords(rect, sw['x1'], y, sw['x2'], y+yspan)
+            pigCanvas.coords(lid, sw['x1'], y+2)
+            pigCanvas.coords(base, sw['x1']-5, y+yspan)
+            pigCanvas.coords(text, sw['xm'], y)
+            pigCanvas.coords(st, sw['x2']-10, y+yspan+18)
+            pigCanvas.itemconfigure(text, text=formatted)
+            pigCanvas.itemconfigure(st, text=status)
+            if group['sttag']:
+                pigCanvas.dtag(st, group['sttag'])
+            if sttag:
+                pigCanvas.addtag_withtag(sttag, st)
+            group['sttag'] = sttag
+            for item in group['ids']:
+                pigCanvas.itemconfigure(item, state='normal')
+            return group
+            
         #rect to hold text
-        self.convoScroll.create_rectangle((swtch[S]['x1'], pigCanvas.current_Y,
-                                 swtch[S]['x2'], pigCanvas.current_Y+yspan),
-                                fill=swtch[S]['clr'],
+        rect = pigCanvas.create_rectangle((sw['x1'], y, sw['x2'], y+yspan),
+                                fill=sw['clr'],
                                 outline='', 
-                                tag=swtch[S]['tag'],
+                                tag=(sw['tag'], 'rect'),
                                )
                                
         #lid 
-        self.convoScroll.create_image((swtch[S]['x1'], pigCanvas.current_Y+2), 
+        lid = pigCanvas.create_image((sw['x1'], y+2), 
                             anchor='sw',
-                            image=self.images[S]['lid'],
-                            tag=swtch[S]['tag'],
+                            image=self.getImage(S, 'lid'),
+                            tag=sw['tag'],
                            )
                            
         #base
-        self.convoScroll.create_image((swtch[S]['x1']-5, pigCanvas.current_Y+yspan),
+        base = pigCanvas.create_image((sw['x1']-5, y+yspan),
                             anchor='nw',
-                            image=self.images[S]['base'],
-                            tag=swtch[S]['tag'],
+                            image=self.getImage(S, 'base'),
+                            tag=sw['tag'],
                            )
         
         #text message itself
-        self.convoScroll.create_text((swtch[S]['xm'], pigCanvas.current_Y),
+        text = pigCanvas.create_text((sw['xm'], y),
                            text=formatted,
                            anchor='nw',
                            font=('arial', 12),
                            fill=self.cv,
-                           tag=swtch[S]['tag'],
+                           tag=(sw['tag'], 'txt'),
+                          )
+        
+        #delivery status, tucked into the pig's base. Empty for their messages
+        st = pigCanvas.create_text((sw['x2']-10, y+yspan+18),
+                           text=status,
+                           anchor='ne',
+                           font=('arial', 8),
+                           fill=self.cv,
+                           tag=(sw['tag'], 'txt', sttag) if sttag else (sw['tag'], 'txt'),
                           )
             
-        #yspan for rows, 18 for last one, padding
-        pigCanvas.current_Y += yspan + 18 + 35   
+        return {'S':S, 'ids':(rect, lid, base, text, st), 'sttag':sttag}
 
 
 
 
 
-test1 = Gui() 
+def main():
+    Gui().run()
+    
+    
+if __name__ == "__main__":
+    main()
 
@@ -0,0 +1,311 @@
+#headless daemon
+"""
+Runs an Oink node without Tk: Model and its PigServer, plus scanning,
+driven by one select() loop instead of the GUI's Tk loop.
+
+It's controlled with JSON lines, either over stdin/stdout (default) or
+over a local Unix socket (--socket PATH, any number of clients). Each
+line in is one command, each line out is a reply or an event. Replies
+echo back the command's "ref" if it had one.
+
+Commands:
+    {"op":"send", "to":"127.0.0.5;49691", "text":"hi"}  -> {"ok":true, "id":...}
+    {"op":"contacts"}                                   -> {"ok":true, "contacts":[...]}
+    {"op":"messages", "with":"127.0.0.5;49691"}         -> {"ok":true, "messages":[...]}
+    {"op":"scan"}                                       -> {"ok":true}
+    {"op":"nickname", "nickname":"bob"}                 -> {"ok":true}
+    {"op":"group", "name":"pigs", "members":[key,...]}  -> {"ok":true, "with":groupkey}
+    {"op":"profile", "on":true, "seconds":10}           -> {"ok":true}  spans on, cProfile for 10s
+
+Events (sent to everyone, as they happen):
+    {"event":"message", "with":key, "message":{...}}    inbound message
+    {"event":"status", "with":key, "id":..., "state":"acked"}   our send settled/changed
+                                                        (plus "member":key for groups)
+    {"event":"contact", "with":key, "nickname":..., "online":...}   added/renamed/presence
+    {"event":"removed", "with":key}
+
+Model pokes the loop through a pipe (see Model.setWakeup), same as the
+GUI does, so messages go out as events as soon as they land and nothing
+runs while idle except the scan timer.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import selectors
+
+import model
+import metrics
+import profiling
+from skt import capture
+
+
+class Daemon:
+
+    def __init__(self, mdl, scanFrequency=5.0):
+        self.model = mdl
+        self.scanFrequency = scanFrequency  #seconds, None to never scan
+        self.nextScan = time.monotonic()
+        self.running = False
+        self.sel = selectors.DefaultSelector()
+        self.clients = {}       #file object -> {'buf':bytes, 'write':fn}
+        self.pending = {}       #msg id -> [Delivery, state reported]
+        self.stopOnEOF = False
+
+        #model wakes us through this pipe
+        self.wakeRead, self.wakeWrite = os.pipe()
+        os.set_blocking(self.wakeRead, False)
+        os.set_blocking(self.wakeWrite, False)
+        self.sel.register(self.wakeRead, selectors.EVENT_READ, data='wake')
+        self.model.setWakeup(self.wake)
+
+
+    #-------------Transports-----------#
+
+    def serveStdio(self, out=sys.stdout):
+        """Commands on stdin, replies and events on out. Ends at EOF"""
+        def write(line):
+            out.write(line + '\n')
+            out.flush()
+        self.addClient(sys.stdin.buffer.raw, write)
+        self.stopOnEOF = True
+        self.loop()
+
+    def serveUnix(self, path):
+        """Commands and events over a Unix socket. Runs until killed"""
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        lsock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        lsock.bind(path)
+        lsock.listen()
+        lsock.setblocking(False)
+        self.sel.register(lsock, selectors.EVENT_READ, data='listen')
+        print(f"Control socket on {path}")
+        try:
+            self.loop()
+        finally:
+            lsock.close()
+            os.unlink(path)
+
+    def addClient(self, fileobj, write):
+        self.clients[fileobj] = {'buf':b'', 'write':write}
+        self.sel.register(fileobj, selectors.EVENT_READ, data='client')
+
+    def dropClient(self, fileobj):
+        self.sel.unregister(fileobj)
+        del self.clients[fileobj]
+        if fileobj is not sys.stdin.buffer.raw:
+            fileobj.close()
+        if self.stopOnEOF:
+            self.running = False
+
+
+    #-------------Loop-----------#
+
+    def wake(self):
+        """Called from server/sender threads"""
+        try:
+            os.write(self.wakeWrite, b'!')
+        except BlockingIOError:
+            pass    #pipe full, a wakeup is already pending
+
+    def loop(self):
+        self.running = True
+        while self.running:
+            #sleep until something happens, or the next scan is due
+            timeout = None
+            if self.scanFrequency is not None:
+                timeout = max(0, self.nextScan - time.monotonic())
+            wait = profiling.tick()
+            if wait is not None:
+                timeout = wait if timeout is None else min(timeout, wait)
+
+            for key, mask in self.sel.select(timeout):
+                if key.data == 'wake':
+                    try:
+                        os.read(self.wakeRead, 4096)
+                    except BlockingIOError:
+                        pass
+                elif key.data == 'listen':
+                    conn, _ = key.fileobj.accept()
+                    self.addClient(conn, self.socketWriter(conn))
+                else:
+                    self.readClient(key.fileobj)
+
+            self.model.checkInQueue()
+            self.publishChanges()
+
+            if self.scanFrequency is not None and time.monotonic() >= self.nextScan:
+                self.model.checkPresence(lease=2 * self.scanFrequency)
+                self.model.discover()
+                self.nextScan = time.monotonic() + self.scanFrequency
+
+    def socketWriter(self, conn):
+        def write(line):
+            try:
+                conn.sendall(line.encode('utf-8') + b'\n')
+            except OSError:
+                pass    #client went away, reader will notice
+        return write
+
+    def readClient(self, fileobj):
+        client = self.clients[fileobj]
+        try:
+            if isinstance(fileobj, socket.socket):
+                data = fileobj.recv(4096)
+            else:
+                data = os.read(fileobj.fileno(), 4096)
+        except OSError:
+            data = b''
+        if not data:
+            self.dropClient(fileobj)
+            return
+
+        client['buf'] += data
+        *lines, client['buf'] = client['buf'].split(b'\n')
+        for line in lines:
+            if line.strip():
+                client['write'](json.dumps(self.handle(line)))
+
+
+    #-------------Commands and events-----------#
+
+    def handle(self, line):
+        """Run one command line, return the reply dict"""
+        cmd = None
+        try:
+            cmd = json.loads(line)
+            op = cmd.get('op')
+            reply = {'ok':True}
+
+            if op == 'send':
+                fromkey = cmd['to']
+                if fromkey not in self.model.contacts:
+                    self.model.addContact({'from':self.model.stringToAddress(fromkey)})
+                result = self.model.sendMessage(fromkey, cmd['text'])
+                if isinstance(result, list):
+                    #group, one delivery per member
+                    for delivery in result:
+                        self.pending[delivery.msg['id'] + ';' + delivery.fromkey] = [delivery, None]
+                    reply['id'] = self.model.messages[fromkey][-1]['id']
+                else:
+                    self.pending[result.msg['id']] = [result, None]
+                    reply['id'] = result.msg['id']
+            elif op == 'contacts':
+                reply['contacts'] = [self.contactInfo(fromkey) for fromkey in self.model.ordered]
+            elif op == 'messages':
+                reply['messages'] = self.model.messages[cmd['with']]
+            elif op == 'scan':
+                self.model.scan()
+            elif op == 'group':
+                reply['with'] = self.model.createGroup(cmd['name'], cmd['members'])
+            elif op == 'nickname':
+                self.model.NICKNAME = cmd['nickname']
+            elif op == 'profile':
+                profiling.enable(cmd.get('on', True))
+                if cmd.get('seconds'):
+                    reply['window'] = profiling.startWindow(cmd['seconds'])
+            else:
+                reply = {'ok':False, 'error':f"unknown op {op!r}"}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            reply = {'ok':False, 'error':repr(e)}
+
+        if isinstance(cmd, dict) and 'ref' in cmd:
+            reply['ref'] = cmd['ref']
+        return reply
+
+    def contactInfo(self, fromkey):
+        contact = self.model.contacts[fromkey]
+        info = {'with':fromkey, 'nickname':contact['nickname'],
+                'online':contact.get('online', True),
+                'unread':self.model.unreadCount(fromkey)}
+        if 'members' in contact:
+            info['members'] = contact['members']
+        return info
+
+    def publishChanges(self):
+        changes = self.model.popChanges()
+        self.publishStatus(changes['status'])
+        if not self.clients:
+            return
+        own = self.model.addressToString(self.model.ADDRESS)
+
+        for fromkey, msgs in changes['messages'].items():
+            for msg in msgs:
+                if self.model.addressToString(msg['from']) != own:
+                    self.broadcast({'event':'message', 'with':fromkey, 'message':msg})
+
+        for fromkey in changes['added'] | changes['renamed'] | changes['presence']:
+            if fromkey in self.model.contacts:
+                self.broadcast(dict(self.contactInfo(fromkey), event='contact'))
+
+        for fromkey in changes['removed']:
+            self.broadcast({'event':'removed', 'with':fromkey})
+
+    def publishStatus(self, status):
+        """
+        Status events for our sends. Runs with or without clients, so 
+        deliveries don't pile up in pending after the sender disconnects. 
+        An entry goes once its final state has been sent out: the worker 
+        thread sets delivery.state before Model hears about it, so going by 
+        delivery.state alone could drop it before its event.
+        """
+        for key, item in list(self.pending.items()):
+            delivery, reported = item
+            convo = delivery.groupkey or delivery.fromkey
+            if convo in status and delivery.state != reported:
+                reported = item[1] = delivery.state
+                event = {'event':'status', 'with':convo, 'id':delivery.msg['id'], 
+                         'state':reported}
+                if delivery.groupkey:
+                    event['member'] = delivery.fromkey
+                self.broadcast(event)
+            if reported in ('acked', 'failed'):
+                del self.pending[key]
+
+    def broadcast(self, event):
+        line = json.dumps(event)
+        for client in list(self.clients.values()):
+            client['write'](line)
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless Oink node")
+    parser.add_argument('--socket', help="serve on this Unix socket instead of stdin/stdout")
+    parser.add_argument('--address', help="listen on ip;port instead of picking from config")
+    parser.add_argument('--scan', type=float, default=5.0,
+                        help="seconds between subnet scans, 0 to never scan")
+    parser.add_argument('--capture', help="record inbound traffic to this file, see skt/capture.py")
+    args = parser.parse_args(argv)
+
+    #stdout is the protocol channel, so everyone's print()s go to stderr
+    out = sys.stdout
+    sys.stdout = sys.stderr
+
+    address = None
+    if args.address:
+        ip, port = args.address.split(';')
+        address = (ip, int(port))
+
+    if args.capture:
+        capture.start(args.capture)
+    daemon = Daemon(model.Model(address), args.scan or None)
+    metrics.start()
+    profiling.start()
+    try:
+        if args.socket:
+            daemon.serveUnix(args.socket)
+        else:
+            daemon.serveStdio(out)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#profiling
+"""
+Timing and profiling hooks for a running instance, so hot paths can be
+looked at without editing code. Off unless config.PROFILE is set or
+enable() is called (the GUI binds Ctrl+Shift+P, oinkd has a "profile" op).
+
+    @span('name')   wraps a function. While enabled each call is timed into
+                    the metrics histogram span.name_ms, otherwise it costs
+                    one flag check.
+    watchTk()       times every Tk callback (commands, binds, after()).
+                    While enabled, any that block the loop longer than
+                    config.SLOW_MS get logged, to config.SLOW_LOG or stdout.
+    timedCall(fn)   the same check for a callback Tk calls some other way,
+                    eg createfilehandler ones like Gui.onWake, which don't
+                    go through tkinter.CallWrapper.
+    startWindow()   cProfile the calling thread for a while, then write a
+                    .pstats file to config.PROFILE_DIR. cProfile only sees
+                    the thread it was started in, so the GUI/daemon loop
+                    calls tick() to stop it (and to start the next one when
+                    config.PROFILE_EVERY is set).
+
+Open the .pstats files with python -m pstats FILE, or snakeviz.
+"""
+
+import os
+import time
+import cProfile
+import functools
+import threading
+
+import config
+import metrics
+
+
+enabled = False
+window = None           #[Profile, stop at, thread id] while one is running
+nextWindow = None       #monotonic time the next sampled window starts
+
+SLOW = metrics.counter('profile.slow_callbacks')
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+    print('profiling', 'on' if on else 'off')
+
+
+def span(name):
+    """Decorator. Time calls into span.<name>_ms while profiling is enabled"""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.histogram('span.' + name + '_ms').observe(
+                    (time.perf_counter() - start) * 1000)
+        return timed
+    return wrap
+
+
+def slow(name, ms):
+    SLOW.inc()
+    line = f"{time.strftime('%H:%M:%S')} slow: {name} blocked the loop {ms:.0f}ms"
+    if config.SLOW_LOG:
+        with open(config.SLOW_LOG, 'a') as f:
+            f.write(line + '\n')
+    else:
+        print(line)
+
+
+def checkSlow(fn, start):
+    ms = (time.perf_counter() - start) * 1000
+    if ms > config.SLOW_MS:
+        slow(getattr(fn, '__qualname__', repr(fn)), ms)
+
+
+def watchTk():
+    """Time every Tk callback. Patches tkinter.CallWrapper, so it covers ones already bound"""
+    import tkinter
+    if getattr(tkinter.CallWrapper, 'watched', False):
+        return
+    call = tkinter.CallWrapper.__call__
+
+    def watchedCall(self, *args):
+        if not enabled:
+            return call(self, *args)
+        start = time.perf_counter()
+        try:
+            return call(self, *args)
+        finally:
+            checkSlow(self.func, start)
+
+    tkinter.CallWrapper.__call__ = watchedCall
+    tkinter.CallWrapper.watched = True
+
+
+def timedCall(fn):
+    """Wrap a callback that doesn't go through CallWrapper so it gets logged when slow too"""
+    @functools.wraps(fn)
+    def timed(*args):
+        if not enabled:
+            return fn(*args)
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            checkSlow(fn, start)
+    return timed
+
+
+
+#-------------cProfile windows-----------#
+
+def startWindow(seconds=None):
+    """Start profiling the calling thread. Returns False if a window is already running"""
+    global window
+    if window is not None:
+        return False
+    prof = cProfile.Profile()
+    prof.enable()
+    window = [prof, time.monotonic() + (seconds or config.PROFILE_WINDOW), threading.get_ident()]
+    return True
+
+
+def stopWindow():
+    """Stop the running window and write it out. Call from the thread that started it"""
+    global window
+    prof, _, ident = window
+    window = None
+    prof.disable()
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(config.PROFILE_DIR, 'oink-%s-%d.pstats' % (time.strftime('%Y%m%d-%H%M%S'), ident))
+    prof.dump_stats(path)
+    print('wrote profile', path)
+    return path
+
+
+def tick():
+    """
+    Call from the loop thread. Ends a window that's run its time, starts a
+    sampled one when it's due. Returns seconds until it wants calling again,
+    or None if nothing's scheduled.
+    """
+    global nextWindow
+    now = time.monotonic()
+    if window is not None and window[2] == threading.get_ident():
+        if now < window[1]:
+            return window[1] - now
+        stopWindow()
+        if config.PROFILE_EVERY:
+            nextWindow = now + config.PROFILE_EVERY
+
+    if nextWindow is not None:
+        if now < nextWindow:
+            return nextWindow - now
+        nextWindow = None
+        startWindow()
+        return config.PROFILE_WINDOW
+    return None
+
+
+def start():
+    """Apply config at startup. Call from the loop thread"""
+    if config.PROFILE:
+        enable()
+    if config.PROFILE_WINDOW:
+        startWindow()
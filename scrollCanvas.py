@@ -1,6 +1,7 @@
 #scrollCanvas class
 
 import tkinter
+import bisect
 from functools import partial
 
 class ScrollCanvas(tkinter.Canvas):
@@ -24,25 +25,121 @@ class ScrollCanvas(tkinter.Canvas):
         #pack canvas
         self.pack(fill='both', expand=True, side='top') 
         
+    def refresh(self):
+        #after adding items to a finished canvas, just grow the scrollregion
+        self.configure(scrollregion=self.bbox('all'))
+        
         
 class PigCanvas(ScrollCanvas):
     """
     This extends scrollCanvas. We're just holding some data in the object, 
     and adding a callback function to slide messages when the window is resized.
+    
+    Messages aren't drawn when they're added. addRow() just records the layout 
+    (where the bubble goes and how tall it is), which is cheap. Canvas items only 
+    exist for rows near the visible part of the canvas: whenever the view moves, 
+    Tk calls on_scroll() (our yscrollcommand) and render() draws rows coming 
+    into range, using the drawRow callback, and hides rows going out of range. 
+    Hidden item groups go in a pool and get reused for the next rows drawn.
+    
+    With windowed=False every row is drawn, like the old behaviour.
+    
+    self.width is our cached canvas width, kept up to date from <Configure> 
+    events, so drawing never has to ask Tk for window geometry. Resizes are 
+    coalesced: a drag fires lots of events, we relayout once per frame.
     """
-    def __init__(self, parent, **kwargs):
+    FRAME_MS = 16
+    def __init__(self, parent, drawRow=None, windowed=True, **kwargs):
         super().__init__(parent, **kwargs)
         
         self.height = self.winfo_reqheight()
         self.width = self.winfo_reqwidth()
         self.current_Y = 0
+        self.shown = set()      #id() of every message laid out
+        self.statusItems = {}   #msg id -> [msg, status shown], until acked/failed
+        
+        #layout and drawing state
+        self.rows = []          #[msg, y, yspan, formatted, S] per message, top to bottom
+        self.ys = []            #just the y of each row, for bisect
+        self.drawn = {}         #row index -> item group currently on canvas
+        self.pool = {'me':[], 'th':[]}  #hidden item groups, by sender
+        self.drawRow = drawRow  #drawRow(canvas, row, group or None) -> group
+        self.windowed = windowed
+        
+        self.pendingWidth = None
+        self.resizeJob = None
+        self.bind("<Configure>", self.on_resize)
+        self.bind("<Destroy>", self.on_destroy)
 
-        def do_binding():
-            self.bind("<Configure>", self.on_resize)
-        self.after(1000, do_binding)  
+    def on_destroy(self, event):
+        #ConvoView() rebuilds us, don't let a queued relayout hit the dead widget
+        if event.widget is self and self.resizeJob is not None:
+            self.after_cancel(self.resizeJob)
+            self.resizeJob = None
 
     def on_resize(self, event):
-        #I'm shocked this works. We just move all the 'me' items according to event width.
-        if event.width != self.width:
-            self.moveto('me', x=event.width-300)
-            self.width = event.width 
+        #just note the width, relayout() picks up the last one
+        self.pendingWidth = event.width
+        if self.resizeJob is None:
+            self.resizeJob = self.after(self.FRAME_MS, self.relayout)
+            
+    def relayout(self):
+        #We just slide all the 'me' items over by however much the width changed.
+        self.resizeJob = None
+        dx = self.pendingWidth - self.width
+        if dx:
+            self.move('me', dx, 0)
+            self.width = self.pendingWidth
+            self.refresh()
+            
+    def addRow(self, msg, S, formatted, yspan):
+        """Lay out one message at current_Y. Drawing happens in render()"""
+        self.rows.append([msg, self.current_Y, yspan, formatted, S])
+        self.ys.append(self.current_Y)
+        self.shown.add(id(msg))
+        
+        #yspan for rows, 18 for last one, padding
+        self.current_Y += yspan + 18 + 35
+    
+    def finish(self):
+        #pack first so the canvas has a real size, then let on_scroll drive drawing
+        self.pack(fill='both', expand=True, side='top') 
+        self.update_idletasks()
+        self.configure(yscrollcommand=self.on_scroll)
+        self.refresh()
+        
+    def refresh(self):
+        #scrollregion comes from the layout, most rows have no items to bbox.
+        #lids stick up 15px above the first row.
+        self.configure(scrollregion=(0, -15, self.width, self.current_Y))
+        
+    def on_scroll(self, first, last):
+        self.scroll_y.set(first, last)
+        self.render(float(first), float(last))
+        
+    def render(self, first, last):
+        """Make sure rows within a screen of the view (first/last fractions) are drawn"""
+        if self.windowed:
+            total = self.current_Y + 15
+            top = first*total - 15
+            bottom = last*total - 15
+            margin = bottom - top
+            lo = max(0, bisect.bisect_right(self.ys, top - margin) - 1)
+            hi = bisect.bisect_right(self.ys, bottom + margin)
+        else:
+            lo, hi = 0, len(self.rows)
+        
+        #recycle whatever scrolled out of range
+        for index in list(self.drawn):
+            if not lo <= index < hi:
+                group = self.drawn.pop(index)
+                for item in group['ids']:
+                    self.itemconfigure(item, state='hidden')
+                self.pool[group['S']].append(group)
+                
+        #draw whatever scrolled in
+        for index in range(lo, hi):
+            if index not in self.drawn:
+                row = self.rows[index]
+                pool = self.pool[row[4]]
+                self.drawn[index] = self.drawRow(self, row, pool.pop() if pool else None)
@@ -0,0 +1,220 @@
+#traffic capture
+"""
+Records every request frame PigServer receives, and plays them back.
+
+Recording is off unless something calls start(path): Model does when
+config.CAPTURE_FILE is set, oinkd with --capture FILE. While it's on,
+pigserverlibrary.SockData hands each complete frame (the exact bytes off
+the wire: 2-byte header length, json header, content) to record(). Files
+are append-only, so a node can be restarted onto the same file:
+
+    b'OINKCAP1'                                     once, at the start
+    >dBI  time.time(), len(peer), len(frame)        then per frame
+    peer  "ip;port" it came from, utf-8
+    frame
+
+Replaying:
+    python -m skt.capture show FILE
+    python -m skt.capture replay FILE --to "127.0.0.7;49691" --speed 10
+
+replay() sends the same bytes to a node, one connection per frame like
+the real senders, keeping the original gaps (divided by speed, 0 for no
+waiting). feed() puts the decoded messages straight into a queue instead,
+eg a Model's inQueue, for replaying without the network. Messages keep
+their original 'from', so a node answering replayed scans is replying to
+the original peers.
+"""
+
+import io
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+import threading
+
+
+MAGIC = b'OINKCAP1'
+RECORD = struct.Struct('>dBI')
+
+recorder = None
+
+
+class Recorder:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.frames = 0
+
+    def write(self, peer, frame):
+        peer = peer.encode('utf-8')
+        record = RECORD.pack(time.time(), len(peer), len(frame)) + peer + frame
+        with self.lock:
+            self.file.write(record)
+            self.frames += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def start(path):
+    """Start recording to path. Already recording there is fine"""
+    global recorder
+    if recorder is not None:
+        if recorder.path == path:
+            return recorder
+        stop()
+    recorder = Recorder(path)
+    print('capturing traffic to', path)
+    return recorder
+
+
+def stop():
+    global recorder
+    if recorder is not None:
+        recorder.close()
+        recorder = None
+
+
+def record(addr, frame):
+    """Called by SockData with the address it came from and the whole frame"""
+    if recorder is not None:
+        recorder.write(f'{addr[0]};{addr[1]}', frame)
+
+
+
+#-------------Reading-----------#
+
+def frames(path):
+    """Yields (time, peer, frame) for every record in a capture file"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an oink capture")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return      #end, or a record cut short by a crash
+            stamp, peerlen, framelen = RECORD.unpack(head)
+            peer = f.read(peerlen).decode('utf-8')
+            frame = f.read(framelen)
+            if len(frame) < framelen:
+                return
+            yield stamp, peer, frame
+
+
+def decode(frame):
+    """Frame bytes -> request dict (action/value), or None for non-json frames"""
+    hdrlen = struct.unpack('>H', frame[:2])[0]
+    header = json.loads(frame[2:2 + hdrlen].decode('utf-8'))
+    if header.get('content-type') != 'text/json':
+        return None
+    content = frame[2 + hdrlen:2 + hdrlen + header['content-length']]
+    return json.load(io.TextIOWrapper(io.BytesIO(content), encoding=header['content-encoding']))
+
+
+def messages(request):
+    """Messages carried by a request, same as SockData.process_request queues them"""
+    if request is None:
+        return []
+    if request.get('action') == 'message':
+        return [request.get('value')]
+    if request.get('action') == 'batch':
+        return list(request.get('value'))
+    return []
+
+
+def paced(path, speed):
+    """frames(), but each one comes out when it's due at speed x original"""
+    first = start = None
+    for stamp, peer, frame in frames(path):
+        if first is None:
+            first, start = stamp, time.monotonic()
+        if speed:
+            wait = (stamp - first) / speed - (time.monotonic() - start)
+            if wait > 0:
+                time.sleep(wait)
+        yield stamp, peer, frame
+
+
+
+#-------------Replaying-----------#
+
+def sendFrame(addr, frame, timeout=5):
+    """Send raw frame bytes, wait for the server to answer and hang up. True if it answered"""
+    try:
+        with socket.create_connection(addr, timeout=timeout) as sock:
+            sock.sendall(frame)
+            answered = False
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    return answered
+                answered = True
+    except OSError:
+        return False
+
+
+def replay(path, addr, speed=1.0, timeout=5):
+    """Send every frame in the capture to addr. Returns (sent, answered)"""
+    sent = answered = 0
+    for stamp, peer, frame in paced(path, speed):
+        sent += 1
+        answered += sendFrame(addr, frame, timeout)
+    return sent, answered
+
+
+def feed(path, queue, speed=0):
+    """Put every captured message into queue, eg a Model's inQueue. Returns how many"""
+    count = 0
+    for stamp, peer, frame in paced(path, speed):
+        for msg in messages(decode(frame)):
+            queue.put(msg)
+            count += 1
+    return count
+
+
+def summary(path):
+    count = size = msgs = 0
+    first = last = None
+    hosts = set()
+    for stamp, peer, frame in frames(path):
+        count += 1
+        size += len(frame)
+        msgs += len(messages(decode(frame)))
+        hosts.add(peer.split(';')[0])
+        first = stamp if first is None else first
+        last = stamp
+    return {'frames': count, 'messages': msgs, 'bytes': size, 'hosts': len(hosts),
+            'seconds': round(last - first, 3) if count else 0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show or replay an oink traffic capture")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    show = sub.add_parser('show', help="summarize a capture")
+    show.add_argument('file')
+    play = sub.add_parser('replay', help="send a capture to a node")
+    play.add_argument('file')
+    play.add_argument('--to', required=True, help="ip;port of the node")
+    play.add_argument('--speed', type=float, default=1.0, help="x original speed, 0 for flat out")
+    play.add_argument('--timeout', type=float, default=5)
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'show':
+        print(json.dumps(summary(args.file), indent=2))
+    else:
+        ip, port = args.to.split(';')
+        start = time.perf_counter()
+        sent, answered = replay(args.file, (ip, int(port)), args.speed, args.timeout)
+        print(f"replayed {sent} frames, {answered} answered, "
+              f"in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
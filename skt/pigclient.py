@@ -2,21 +2,54 @@
 """
 This handles sending a message. 
 
+sendMessage() returns the server's response (a dict, for json messages), 
+or None if it couldn't be delivered. An answer isn't always an ack: the 
+server also answers requests it doesn't understand with an error result, 
+so check acked(response) before treating a message as delivered. Pass a 
+timeout (in seconds) to give up on hosts that don't answer, instead of 
+waiting for the OS-level TCP connect timeout.
+
+sendBatch() is the same thing for a list of messages, all sent in one 
+request over one connection. Server acks the whole batch at once.
+
+sendMany() sends one request to a list of hosts, from the calling thread, 
+with up to `limit` connections open at once. The request can be encoded 
+once up front with encode(), since every host gets the same bytes. 
+Server closes each connection after answering, so it's one connection 
+per host, but they all share one selector instead of a thread each.
 """
 
 import socket
+import time
 import selectors
 import traceback
 
+import metrics
 from skt import pigclientlibrary
 
 
 VERBOSE = False
 
+SENDS = metrics.counter('client.sends')
+MESSAGES_OUT = metrics.counter('client.messages_out')
+ACKED = metrics.counter('client.acked')
+FAILED = metrics.counter('client.failed')
+TIMEOUTS = metrics.counter('client.timeouts')
+ERRORS = metrics.counter('client.errors')
+CONNECTIONS = metrics.gauge('client.connections')
+SEND_MS = metrics.histogram('client.send_ms')
+
+#what pigserverlibrary answers a message/batch it took
+ACK = "ACKNOWLEDGED AND RECEIVED"
+
+
+def acked(response):
+    return isinstance(response, dict) and response.get('result') == ACK
+
 #just returns dict of header info, plus sub-dict with action/value.
 def create_request(action, value):
 
-    if action == "message":
+    if action == "message" or action == "batch":
         return dict(
             type="text/json",
             encoding="utf-8",
@@ -35,30 +68,139 @@ def create_request(action, value):
 def start_connection(addr, request, sel):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setblocking(False)
-    sock.connect_ex(addr)
+    try:
+        sock.connect_ex(addr)
+    except (OSError, OverflowError):
+        #bad address, eg host that doesn't resolve or port out of range
+        sock.close()
+        raise
     
     #create SockData object, register with selector. 
     events = selectors.EVENT_READ | selectors.EVENT_WRITE
     sockdata = pigclientlibrary.SockData(sel, sock, addr, request)
     sel.register(sock, events, data=sockdata)
+    return sockdata
+
+
+
+def sendMessage(addr, message, timeout=None):
+    MESSAGES_OUT.inc()
+    return send(addr, create_request("message", message), timeout)
+
+
+def sendBatch(addr, messages, timeout=None):
+    MESSAGES_OUT.inc(len(messages))
+    return send(addr, create_request("batch", messages), timeout)
+
+
+def encode(action, value):
+    """Wire bytes for a request, to hand to sendMany() (or send()) as is"""
+    sockdata = pigclientlibrary.SockData(None, None, None, create_request(action, value))
+    sockdata.queue_request()
+    return sockdata._send_buffer
+
+
+def sendMany(addrs, request, timeout=None, limit=32):
+    """Same request to every addr. Returns responses in addrs order, None where it failed"""
+    sel = selectors.DefaultSelector()
+    responses = [None] * len(addrs)
+    waiting = list(enumerate(addrs))[::-1]
+    active = {}     #sockdata -> (index, started, deadline)
+    MESSAGES_OUT.inc(len(addrs))
 
+    try:
+        while waiting or active:
+            #keep up to limit connections going
+            while waiting and len(active) < limit:
+                index, addr = waiting.pop()
+                started = time.perf_counter()
+                SENDS.inc()
+                try:
+                    sockdata = start_connection(addr, request, sel)
+                except (OSError, OverflowError):
+                    ERRORS.inc()
+                    FAILED.inc()
+                    continue
+                CONNECTIONS.inc()
+                active[sockdata] = (index, started, 
+                                    None if timeout is None else time.monotonic() + timeout)
+            
+            for key, mask in sel.select(timeout=0.05):
+                try:
+                    key.data.process_events(mask)
+                except Exception:
+                    ERRORS.inc()
+                    if VERBOSE:
+                        print(
+                            f"Main: Error: Exception for {key.data.addr}:\n"
+                            f"{traceback.format_exc()}"
+                        )
+                    key.data.close()
+            
+            #collect finished ones (they close themselves), drop timed out ones
+            now = time.monotonic()
+            for sockdata, (index, started, deadline) in list(active.items()):
+                if sockdata.sock is not None:
+                    if deadline is None or now < deadline:
+                        continue
+                    TIMEOUTS.inc()
+                    sockdata.close()
+                del active[sockdata]
+                CONNECTIONS.dec()
+                responses[index] = sockdata.response
+                (FAILED if sockdata.response is None else ACKED).inc()
+                SEND_MS.observe((time.perf_counter() - started) * 1000)
+    finally:
+        for sockdata in active:
+            sockdata.close()
+            CONNECTIONS.dec()
+        sel.close()
+        
+    return responses
 
 
-def sendMessage(addr, message):
+def send(addr, request, timeout=None):
 
     sel = selectors.DefaultSelector()
+    started = time.perf_counter()
+    SENDS.inc()
 
-    request = create_request("message", message)
-    start_connection(addr, request, sel)
+    try:
+        sockdata = start_connection(addr, request, sel)
+    except (OSError, OverflowError):
+        ERRORS.inc()
+        FAILED.inc()
+        sel.close()
+        if VERBOSE:
+            print(f"Main: Can't connect to {addr}:\n{traceback.format_exc()}")
+        return None
+    #only counted once there's a socket, the finally below takes it back off
+    CONNECTIONS.inc()
+    
+    if timeout is not None:
+        deadline = time.monotonic() + timeout
 
     try:
         while True:
-            events = sel.select(timeout=1)
+            #give up once past deadline, closing anything still open
+            wait = 1
+            if timeout is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    TIMEOUTS.inc()
+                    if VERBOSE:
+                        print(f"Main: Timed out sending to {addr}")
+                    for key in list(sel.get_map().values()):
+                        key.data.close()
+                    break
+                
+            events = sel.select(timeout=wait)
             for key, mask in events:
                 sockdata = key.data
                 try:
                     sockdata.process_events(mask)
                 except Exception:
+                    ERRORS.inc()
                     if VERBOSE:
                         print(
                             f"Main: Error: Exception for {sockdata.addr}:\n"
@@ -74,4 +216,9 @@ def sendMessage(addr, message):
         print("Caught keyboard interrupt, exiting")
     finally:
         sel.close()
+        CONNECTIONS.dec()
+        
+    (FAILED if sockdata.response is None else ACKED).inc()
+    SEND_MS.observe((time.perf_counter() - started) * 1000)
+    return sockdata.response
         
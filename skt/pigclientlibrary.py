@@ -4,9 +4,15 @@ import json
 import io
 import struct
 
+import metrics
+import profiling
+
 
 VERBOSE = False
 
+BYTES_IN = metrics.counter('client.bytes_in')
+BYTES_OUT = metrics.counter('client.bytes_out')
+
 
 class SockData:
 
@@ -49,6 +55,7 @@ class SockData:
             pass
         else:
             if data:
+                BYTES_IN.inc(len(data))
                 self._recv_buffer += data
             else:
                 raise RuntimeError("Peer closed.")
@@ -66,6 +73,7 @@ class SockData:
                 # Resource temporarily unavailable (errno EWOULDBLOCK)
                 pass
             else:
+                BYTES_OUT.inc(sent)
                 self._send_buffer = self._send_buffer[sent:]
 
 
@@ -113,6 +121,7 @@ class SockData:
 
 
     #ENTRY POINT. Just calls read() or write().
+    @profiling.span('client.process_events')
     def process_events(self, mask):
         if mask & selectors.EVENT_READ:
             self.read()
@@ -175,6 +184,12 @@ class SockData:
 
     #digests input 'request' dict, encodes, puts in send_buffer, raises flag
     def queue_request(self):
+        #already encoded, eg one frame shared by a whole group (see pigclient.encode)
+        if isinstance(self.request, bytes):
+            self._send_buffer += self.request
+            self._request_queued = True
+            return
+            
         content = self.request["content"]
         content_type = self.request["type"]
         content_encoding = self.request["encoding"]
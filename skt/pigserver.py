@@ -22,9 +22,14 @@ import socket
 import selectors
 import traceback
 
+import metrics
 from skt import pigserverlibrary
 
 
+ACCEPTED = metrics.counter('server.accepted')
+ERRORS = metrics.counter('server.errors')
+
+
 class PigServer:
 
     def __init__(self):
@@ -34,6 +39,7 @@ class PigServer:
     def accept_wrapper(self, sock, queue, sel):
         conn, addr = sock.accept()  # Should be ready to read
         conn.setblocking(False)
+        ACCEPTED.inc()
         sockdata = pigserverlibrary.SockData(sel, conn, addr, queue)
         sel.register(conn, selectors.EVENT_READ, data=sockdata)
 
@@ -67,6 +73,7 @@ class PigServer:
                         try:
                             sockdata.process_events(mask)
                         except Exception:
+                            ERRORS.inc()
                             if self.VERBOSE:
                                 print(
                                     f"Main: Error: Exception for {sockdata.addr}:\n"
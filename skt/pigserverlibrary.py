@@ -4,6 +4,10 @@ import json
 import io
 import struct
 
+import metrics
+import profiling
+from skt import capture
+
 request_search = {
     "morpheus": "Follow the white rabbit. \U0001f430",
     "ring": "In the caves beneath the Misty Mountains. \U0001f48d",
@@ -73,6 +77,11 @@ next time around, write() sees that response flag, and calls _write(), which use
 
 VERBOSE = False
 
+BYTES_IN = metrics.counter('server.bytes_in')
+BYTES_OUT = metrics.counter('server.bytes_out')
+MESSAGES_IN = metrics.counter('server.messages_in')
+CONNECTIONS = metrics.gauge('server.connections')
+
 class SockData:
 
     #This creates all the state stored in message object
@@ -83,11 +92,13 @@ class SockData:
         self._recv_buffer = b""
         self._send_buffer = b""
         self._jsonheader_len = None
+        self._jsonheader_bytes = None   #kept for capture, see record in process_request()
         self.jsonheader = None
         self.request = None
         self.response_created = False
 
         self.queue = queue
+        CONNECTIONS.inc()
 
 
 
@@ -117,6 +128,7 @@ class SockData:
             pass
         else:   #only runs if no exception raised
             if data:
+                BYTES_IN.inc(len(data))
                 self._recv_buffer += data
             else:
                 raise RuntimeError("Peer closed.")
@@ -134,6 +146,7 @@ class SockData:
                 # Resource temporarily unavailable (errno EWOULDBLOCK)
                 pass
             else:
+                BYTES_OUT.inc(sent)
                 self._send_buffer = self._send_buffer[sent:]
                 # Close when the buffer is drained. The response has been sent.
                 if sent and not self._send_buffer:
@@ -179,7 +192,7 @@ class SockData:
             query = self.request.get("value")
             answer = request_search.get(query) or f"No match for '{query}'."
             content = {"result": answer}
-        elif action == "message":
+        elif action == "message" or action == "batch":
             content = {"result": "ACKNOWLEDGED AND RECEIVED"}
         else:
             content = {"result": f"Error: invalid action '{action}'."}
@@ -210,6 +223,7 @@ class SockData:
     #-----------API/PUBLIC CALLS---------------------#
 
     #ALWAYS THE ENTRY POINT!! calls read() or write() depending on selector events
+    @profiling.span('server.process_events')
     def process_events(self, mask):
         if mask & selectors.EVENT_READ:
             self.read()
@@ -251,6 +265,9 @@ class SockData:
 
     #cleanup--unregister from selector/close socket/delete reference
     def close(self):
+        if self.sock is None:
+            return
+        CONNECTIONS.dec()
         if VERBOSE:
             print(f"Closing connection to {self.addr}")
         try:
@@ -289,8 +306,9 @@ class SockData:
     def process_jsonheader(self):
         hdrlen = self._jsonheader_len
         if len(self._recv_buffer) >= hdrlen:
+            self._jsonheader_bytes = self._recv_buffer[:hdrlen]
             self.jsonheader = self._json_decode(
-                self._recv_buffer[:hdrlen], "utf-8"
+                self._jsonheader_bytes, "utf-8"
             )
             self._recv_buffer = self._recv_buffer[hdrlen:]
             for reqhdr in (
@@ -315,6 +333,11 @@ class SockData:
         data = self._recv_buffer[:content_len]
         self._recv_buffer = self._recv_buffer[content_len:]
         
+        #whole frame, exactly as it came in, if we're recording traffic
+        if capture.recorder is not None:
+            capture.record(self.addr, struct.pack(">H", self._jsonheader_len) 
+                           + self._jsonheader_bytes + data)
+        
         #process based on content-type
         if self.jsonheader["content-type"] == "text/json":
             encoding = self.jsonheader["content-encoding"]
@@ -327,6 +350,15 @@ class SockData:
                 if VERBOSE:
                     print("New message: ", self.request.get("value"))
                 self.queue.put(self.request.get("value"))
+                MESSAGES_IN.inc()
+                
+            #batch is just a list of messages, queue each in order
+            elif self.request.get("action") == "batch":
+                if VERBOSE:
+                    print("New batch: ", len(self.request.get("value")))
+                for msg in self.request.get("value"):
+                    self.queue.put(msg)
+                MESSAGES_IN.inc(len(self.request.get("value")))
             
         else:
             # Binary or unknown content-type
@@ -0,0 +1,85 @@
+#textLayout class
+
+import tkinter
+import tkinter.font
+from collections import OrderedDict
+
+class TextLayout:
+    """
+    Wraps message text to a pixel width using real font metrics, and 
+    remembers the result. Layouts are cached by (text, width, font) with 
+    LRU eviction, so redrawing a conversation or contact list doesn't 
+    re-wrap text we've already laid out.
+    
+    wrap() returns (wrapped text, extra rows, line height). Extra rows is 
+    number of lines minus one, same as the old formatMessage() rowcount.
+    """
+    def __init__(self, root, maxsize=5000):
+        self.root = root
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.fonts = {}         #font tuple -> (tkinter Font, linespace)
+        
+    def font(self, font):
+        try:
+            return self.fonts[font]
+        except KeyError:
+            f = tkinter.font.Font(root=self.root, font=font)
+            self.fonts[font] = (f, f.metrics('linespace'))
+            return self.fonts[font]
+        
+    def wrap(self, text, width, font):
+        key = (text, width, font)
+        layout = self.cache.get(key)
+        if layout is not None:
+            self.cache.move_to_end(key)
+            return layout
+            
+        layout = self.cache[key] = self._wrap(text, width, font)
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return layout
+        
+    def _wrap(self, text, width, font):
+        f, linespace = self.font(font)
+        measure = f.measure
+        space = measure(' ')
+        lines = []
+        
+        #keep newlines the sender typed, wrap each paragraph greedily by word
+        for para in text.split('\n'):
+            line = []
+            linewidth = 0
+            for word in para.split(' '):
+                w = measure(word)
+                
+                #word wider than a whole line, break it up by characters
+                if w > width:
+                    if line:
+                        lines.append(' '.join(line))
+                    chunk = ''
+                    linewidth = 0
+                    for ch in word:
+                        cw = measure(ch)
+                        if chunk and linewidth + cw > width:
+                            lines.append(chunk)
+                            chunk = ''
+                            linewidth = 0
+                        chunk += ch
+                        linewidth += cw
+                    line = [chunk]
+                    
+                elif line and linewidth + space + w > width:
+                    lines.append(' '.join(line))
+                    line = [word]
+                    linewidth = w
+                    
+                else:
+                    if line:
+                        linewidth += space
+                    line.append(word)
+                    linewidth += w
+                    
+            lines.append(' '.join(line))
+            
+        return '\n'.join(lines), len(lines) - 1, linespace